@@ -10,6 +10,9 @@ class RobotWrapper(ABC):
     movement_x_accumulator = 0
     movement_y_accumulator = 0
     rotation_accumulator = 0
+    # limits of the adaptive camera capture rate
+    min_capture_fps = 2.0
+    max_capture_fps = 15.0
     @abstractmethod
     def connect(self):
         pass
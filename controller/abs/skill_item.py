@@ -30,25 +30,6 @@ class SkillItem(ABC):
     def execute(self, arg_list: List[Union[int, float, str]]) -> Tuple[Union[int, float, bool, str], bool]:
         pass
 
-    abbr_dict = {}
-    def generate_abbreviation(self, word):
-        split = word.split('_')
-        abbr = ''.join([part[0] for part in split])[0:2]
-
-        if abbr not in self.abbr_dict:
-            self.abbr_dict[abbr] = word
-            return abbr
-        
-        split = ''.join([part for part in split])[1:]
-
-        count = 0
-        while abbr in self.abbr_dict:
-            abbr = abbr[0] + split[count]
-            count += 1
-
-        self.abbr_dict[abbr] = word
-        return abbr
-
     def parse_args(self, args_str_list: List[Union[int, float, str]], allow_positional_args: bool = False):
         """Parses the string of arguments and converts them to the expected types."""
         # Check the number of arguments
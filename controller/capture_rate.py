@@ -0,0 +1,46 @@
+from typing import Optional
+
+'''
+Capture rate of the robot camera, adapted to how fast the YOLO service answers.
+Additive increase while the robot moves or runs a task and the service keeps up,
+multiplicative decrease when frames queue up or the robot is idle, like TCP
+congestion control.
+Several robots sharing one service each settle at their share of its capacity.
+'''
+
+class CaptureRateController:
+    def __init__(self, min_fps: float = 2.0, max_fps: float = 15.0, step: float = 1.0,
+                 backoff: float = 0.75, idle_decay: float = 0.95):
+        if not 0 < min_fps <= max_fps:
+            raise ValueError(f"Invalid capture rate limits: {min_fps}, {max_fps}")
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        # fps added per capture while a task runs, twice that while moving
+        self.step = step
+        # factor applied per capture when overloaded, and when idle
+        self.backoff = backoff
+        self.idle_decay = idle_decay
+        # the fixed rate used before
+        self.fps = min(max(10.0, min_fps), max_fps)
+
+    def update(self, rtt: Optional[float], queue_depth: int, window: int, moving: bool, active: bool) -> float:
+        """
+        Takes the detection round-trip time, the frames waiting for or in the in-flight
+        window, whether the robot is moving and whether a task is running, and returns
+        the delay until the next capture.
+        """
+        if queue_depth > window:
+            # a frame is waiting for the window, the service does not keep up
+            self.fps *= self.backoff
+        elif moving or active:
+            # perception skills such as wait_until want fresh frames even when the robot holds still
+            # with `window` frames in flight the service cannot answer more than window / rtt per second
+            limit = self.max_fps if rtt is None or rtt <= 0 else window / rtt
+            # the scene changes fastest while the robot moves
+            step = 2 * self.step if moving else self.step
+            self.fps = min(self.fps + step, max(limit, self.min_fps))
+        else:
+            # nothing changes the scene but the scene itself
+            self.fps *= self.idle_decay
+        self.fps = min(max(self.fps, self.min_fps), self.max_fps)
+        return 1.0 / self.fps
@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional
+from numpy.typing import NDArray
+import numpy as np
+
+'''
+Detection results in a compact, indexed form. Each YOLO result is converted once,
+when SharedFrame receives it, into an immutable Detections snapshot; skills then
+look objects up by name in O(1) instead of scanning the raw JSON dicts.
+'''
+
+# common names the planner uses for COCO classes
+ALIASES = {
+    'people': 'person',
+    'human': 'person',
+    'man': 'person',
+    'woman': 'person',
+    'bike': 'bicycle',
+    'motorbike': 'motorcycle',
+    'ball': 'sports ball',
+    'phone': 'cell phone',
+    'mobile phone': 'cell phone',
+    'smartphone': 'cell phone',
+    'sofa': 'couch',
+    'table': 'dining table',
+    'plant': 'potted plant',
+    'television': 'tv',
+    'monitor': 'tv',
+    'fridge': 'refrigerator',
+    'glass': 'wine glass',
+    'mug': 'cup',
+    'computer': 'laptop',
+}
+
+class ObjectInfo:
+    def __init__(self, name, x, y, w, h) -> None:
+        self.name = name
+        self.x = float(x)
+        self.y = float(y)
+        self.w = float(w)
+        self.h = float(h)
+
+    def __str__(self) -> str:
+        return f"{self.name} x:{self.x:.2f} y:{self.y:.2f} width:{self.w:.2f} height:{self.h:.2f}"
+
+def split_track_id(name: str) -> tuple:
+    """'person_3' -> ('person', 3), names from a tracking model carry the track id."""
+    class_name, _, suffix = name.rpartition('_')
+    if class_name and suffix.isdigit():
+        return class_name, int(suffix)
+    return name, -1
+
+class Detections:
+    """One frame of detections, stored column-wise. Never modified after creation."""
+    def __init__(self, version: int, timestamp: float, names: List[str], boxes: NDArray[np.float64],
+                 confidences: NDArray[np.float64]):
+        # sequence number of the SharedFrame entry
+        self.version = version
+        self.timestamp = timestamp
+        # full names, e.g. 'person_3'
+        self.names = names
+        # (N, 4) centre x, centre y, width, height, normalized
+        self.boxes = boxes
+        self.confidences = confidences
+        split = [split_track_id(name) for name in names]
+        self.classes = [class_name for class_name, _ in split]
+        self.track_ids = np.array([track_id for _, track_id in split], dtype=np.int32)
+        # name -> row of its first detection, by full name, class name and alias
+        self.index: Dict[str, int] = {}
+        for row in reversed(range(len(names))):
+            self.index[self.classes[row]] = row
+        for row in reversed(range(len(names))):
+            self.index[names[row]] = row
+        for alias, class_name in ALIASES.items():
+            if class_name in self.index and alias not in self.index:
+                self.index[alias] = self.index[class_name]
+        self.lookups: Dict[str, Optional[int]] = {}
+        self.object_list: Optional[List[ObjectInfo]] = None
+
+    def empty(version: int = 0, timestamp: float = 0) -> 'Detections':
+        return Detections(version, timestamp, [], np.zeros((0, 4), dtype=np.float64), np.zeros(0, dtype=np.float64))
+
+    def from_result(yolo_result: dict, version: int, timestamp: float) -> 'Detections':
+        objs = yolo_result.get('result', []) if isinstance(yolo_result, dict) else []
+        names = [obj['name'] for obj in objs]
+        xyxy = np.array([[obj['box']['x1'], obj['box']['y1'], obj['box']['x2'], obj['box']['y2']] for obj in objs],
+                        dtype=np.float64).reshape(-1, 4)
+        boxes = np.empty_like(xyxy)
+        boxes[:, 0:2] = (xyxy[:, 0:2] + xyxy[:, 2:4]) / 2
+        boxes[:, 2:4] = xyxy[:, 2:4] - xyxy[:, 0:2]
+        confidences = np.array([obj.get('confidence', 0) for obj in objs], dtype=np.float64)
+        return Detections(version, timestamp, names, boxes, confidences)
+
+    def from_batch(batch, version: int, timestamp: float) -> 'Detections':
+        """From a DetectionBatch message, its packed arrays convert without a dict per object."""
+        class_names = list(batch.class_names)
+        names = [class_names[class_id] for class_id in batch.class_ids]
+        if len(batch.track_ids) > 0:
+            names = [f'{name}_{track_id}' for name, track_id in zip(names, batch.track_ids)]
+        xyxy = np.array(batch.boxes, dtype=np.float64).reshape(-1, 4)
+        boxes = np.empty_like(xyxy)
+        boxes[:, 0:2] = (xyxy[:, 0:2] + xyxy[:, 2:4]) / 2
+        boxes[:, 2:4] = xyxy[:, 2:4] - xyxy[:, 0:2]
+        return Detections(version, timestamp, names, boxes, np.array(batch.confidences, dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def find(self, object_name: str) -> Optional[int]:
+        """Row of the object by full name, class name or alias, falling back to a name prefix."""
+        row = self.index.get(object_name)
+        if row is None:
+            row = self.index.get(object_name.strip().lower())
+        if row is None and object_name not in self.lookups:
+            prefixed = [self.index[name] for name in self.index if name.startswith(object_name)]
+            # cached per snapshot, so repeated queries for the same object are O(1)
+            self.lookups[object_name] = min(prefixed) if len(prefixed) > 0 else None
+        return row if row is not None else self.lookups[object_name]
+
+    def rows(self, object_name: str) -> List[int]:
+        """All rows of the class the name resolves to."""
+        row = self.find(object_name)
+        if row is None:
+            return []
+        class_name = self.classes[row]
+        return [i for i, name in enumerate(self.classes) if name == class_name]
+
+    def get(self, object_name: str) -> Optional[ObjectInfo]:
+        row = self.find(object_name)
+        return self.object(row) if row is not None else None
+
+    def object(self, row: int) -> ObjectInfo:
+        return ObjectInfo(self.names[row], *self.boxes[row])
+
+    def objects(self) -> List[ObjectInfo]:
+        if self.object_list is None:
+            self.object_list = [self.object(row) for row in range(len(self))]
+        return self.object_list
@@ -0,0 +1,99 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
+from numpy.typing import NDArray
+from PIL import Image
+import numpy as np
+import threading
+import cv2
+
+from .shared_frame import Frame
+
+'''
+Resizing and encoding of frames before they are sent to the YOLO service, on a
+small thread pool so neither the capture loop nor the event loop waits for it
+(PIL and OpenCV release the GIL while encoding). Every codec produces a format
+PIL.Image.open() reads, so the service accepts all of them unchanged.
+
+Codecs take an HxWxC RGB (or HxW grayscale) uint8 array and a quality in 0-100.
+'''
+
+class Buffers(threading.local):
+    """Per-thread arrays reused across frames, a frame size rarely changes."""
+    def __init__(self):
+        self.arrays: Dict[tuple, NDArray[np.uint8]] = {}
+
+    def get(self, name: str, shape: tuple) -> NDArray[np.uint8]:
+        key = (name, shape)
+        if key not in self.arrays:
+            self.arrays[key] = np.empty(shape, dtype=np.uint8)
+        return self.arrays[key]
+
+BUFFERS = Buffers()
+
+def to_bgr(image: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=BUFFERS.get('bgr', image.shape))
+
+def resize(image: NDArray[np.uint8], size: Tuple[int, int]) -> NDArray[np.uint8]:
+    """`size` is (width, height) like PIL."""
+    shape = (size[1], size[0]) + image.shape[2:]
+    return cv2.resize(image, size, dst=BUFFERS.get('resized', shape), interpolation=cv2.INTER_AREA)
+
+def encode_webp(image: NDArray[np.uint8], quality: int) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format='WEBP', quality=quality)
+    return buffer.getvalue()
+
+def encode_jpeg(image: NDArray[np.uint8], quality: int) -> bytes:
+    ok, data = cv2.imencode('.jpg', to_bgr(image), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return data.tobytes()
+
+def encode_png(image: NDArray[np.uint8], quality: int) -> bytes:
+    # lossless, quality only trades size for speed: 100 is the fastest level
+    level = min(9, max(0, round((100 - quality) * 9 / 100)))
+    ok, data = cv2.imencode('.png', to_bgr(image), [cv2.IMWRITE_PNG_COMPRESSION, level])
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return data.tobytes()
+
+def encode_raw(image: NDArray[np.uint8], quality: int) -> bytes:
+    # binary PPM/PGM: a short header and the pixels as they are
+    magic = b'P6' if image.ndim == 3 else b'P5'
+    return b'%s\n%d %d\n255\n' % (magic, image.shape[1], image.shape[0]) + image.tobytes()
+
+# name -> encoder, register more here
+CODECS: Dict[str, Callable[[NDArray[np.uint8], int], bytes]] = {
+    'webp': encode_webp,
+    'jpeg': encode_jpeg,
+    'png': encode_png,
+    'raw': encode_raw,
+}
+
+class FrameEncoder:
+    def __init__(self, codec: str = 'webp', quality: int = 80, workers: int = 2):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}, available: {', '.join(CODECS)}")
+        self.codec = codec
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frame-encoder')
+        # frames encoding or queued for it, see submit()
+        self.slots = threading.BoundedSemaphore(2 * workers)
+
+    def encode(self, frame: Frame, size: Optional[Tuple[int, int]] = None) -> bytes:
+        """Encodes in the calling thread, resizing to `size` (width, height) first if given."""
+        image = frame.image_buffer
+        if size is not None and (image.shape[1], image.shape[0]) != tuple(size):
+            image = resize(image, size)
+        return CODECS[self.codec](image, self.quality)
+
+    def submit(self, frame: Frame, size: Optional[Tuple[int, int]] = None) -> Optional[Future]:
+        """Encodes on the pool, None if it is full so the caller drops the frame instead of queueing it."""
+        if not self.slots.acquire(blocking=False):
+            return None
+        future = self.pool.submit(self.encode, frame, size)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
@@ -0,0 +1,63 @@
+from typing import Optional, Tuple
+from numpy.typing import NDArray
+import numpy as np
+
+from .shared_frame import Frame
+
+'''
+Skips detection on frames that look like the last detected one, e.g. while the
+robot hovers or waits in a delay. Frames are compared as tiny grayscale
+thumbnails, which costs well under a millisecond, and the robot's own motion
+always counts as a change.
+'''
+
+# (width, height) in cells
+THUMBNAIL_SIZE = (32, 24)
+# samples per cell along each axis
+CELL_SAMPLES = 4
+
+def thumbnail(image: NDArray[np.uint8], size: Tuple[int, int] = THUMBNAIL_SIZE) -> NDArray[np.float32]:
+    """Grayscale cell averages of a strided subsample in [0, 1], averaging hides sensor noise."""
+    width, height = size
+    rows, cols = height * CELL_SAMPLES, width * CELL_SAMPLES
+    sample = image[::max(1, image.shape[0] // rows), ::max(1, image.shape[1] // cols)][:rows, :cols]
+    gray = sample.mean(axis=2, dtype=np.float32) if sample.ndim == 3 else sample.astype(np.float32)
+    if gray.shape != (rows, cols):
+        # smaller than the thumbnail, compare the samples themselves
+        return gray / 255
+    return gray.reshape(height, CELL_SAMPLES, width, CELL_SAMPLES).mean(axis=(1, 3)) / 255
+
+class FrameGate:
+    def __init__(self, cell_threshold: float = 0.06, area_threshold: float = 0.005, max_interval: float = 1.0):
+        # a cell changed if its brightness moved by more than cell_threshold,
+        # a frame changed if more than area_threshold of its cells did
+        self.cell_threshold = cell_threshold
+        self.area_threshold = area_threshold
+        # detect at least this often, slow changes add up against the reference
+        self.max_interval = max_interval
+        # thumbnail, capture time and robot pose of the last frame sent to detection
+        self.reference: Optional[NDArray[np.float32]] = None
+        self.reference_ts = 0.0
+        self.pose: Optional[tuple] = None
+        self.skipped = 0
+
+    def changed(self, small: NDArray[np.float32]) -> bool:
+        if self.reference is None or small.shape != self.reference.shape:
+            return True
+        cells = np.abs(small - self.reference) > self.cell_threshold
+        return bool(cells.mean() > self.area_threshold)
+
+    def should_detect(self, frame: Frame, pose: tuple, moving: bool) -> bool:
+        """
+        `pose` is anything that changes when the robot moved, e.g. its movement and rotation
+        accumulators. Frames that are not detected should reuse the result of
+        the reference frame, captured at reference_ts.
+        """
+        small = thumbnail(frame.image_buffer)
+        detect = moving or pose != self.pose or frame.timestamp - self.reference_ts >= self.max_interval \
+            or self.changed(small)
+        if detect:
+            self.reference, self.reference_ts, self.pose = small, frame.timestamp, pose
+        else:
+            self.skipped += 1
+        return detect
@@ -81,16 +81,16 @@ class GearWrapper(RobotWrapper):
         self.robot = Podtp(config)
         self.move_speed_x = 2.5
         self.move_speed_y = 2.8
-        self.unlock_count = 0
+        # keep_active() is called once per captured frame, at a varying rate
+        self.last_unlock = time.time()
         self.model = DirectionPredictor()
         self.model.load_state_dict(torch.load(os.path.join(CURRENT_DIR, 'assets/gear/model.pth')))
         self.model.eval()
 
     def keep_active(self):
-        self.unlock_count += 1
-        if self.unlock_count > 100:
+        if time.time() - self.last_unlock > 10.0:
             self.robot.send_ctrl_lock(False)
-            self.unlock_count = 0
+            self.last_unlock = time.time()
 
     def connect(self):
         if not self.robot.connect():
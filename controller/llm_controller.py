@@ -1,6 +1,7 @@
 from PIL import Image
 import queue, time, os, json
-from typing import Optional, Tuple
+from typing import Callable, Iterator, Optional, Tuple
+from openai import ChatCompletion
 import asyncio
 import uuid
 from enum import Enum
@@ -13,15 +14,19 @@ from .virtual_robot_wrapper import VirtualRobotWrapper
 from .abs.robot_wrapper import RobotWrapper
 from .vision_skill_wrapper import VisionSkillWrapper
 from .llm_planner import LLMPlanner
+from .llm_wrapper import LLMWrapper
 from .skillset import SkillSet, LowLevelSkillItem, HighLevelSkillItem, SkillArg
 from .utils import print_t, input_t
-from .minispec_interpreter import MiniSpecInterpreter, Statement
+from .minispec_interpreter import MiniSpecInterpreter, ExecutionContext
+from .metrics import LatencyMetrics
+from .capture_rate import CaptureRateController
+from .frame_gate import FrameGate
 from .abs.robot_wrapper import RobotType
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class LLMController():
-    def __init__(self, robot_type, use_http=False, message_queue: Optional[queue.Queue]=None):
+    def __init__(self, robot_type, use_http=False, message_queue: Optional[queue.Queue]=None, llm: Optional[LLMWrapper]=None, stream_plan=False):
         self.shared_frame = SharedFrame()
         if use_http:
             self.yolo_client = YoloClient(shared_frame=self.shared_frame)
@@ -29,6 +34,13 @@ class LLMController():
             self.yolo_client = YoloGRPCClient(shared_frame=self.shared_frame)
         self.vision = VisionSkillWrapper(self.shared_frame)
         self.latest_frame = None
+        # execute the plan while the LLM is still generating it, opt-in: a streamed plan
+        # runs before it is complete, so it cannot be validated as a whole first
+        self.stream_plan = stream_plan
+        self.timestamp_first_action = None
+        self.time_to_first_action = None
+        # latency of statements, skills and planner requests, see get_metrics()
+        self.metrics = LatencyMetrics()
         self.controller_active = True
         self.controller_wait_takeoff = True
         self.message_queue = message_queue
@@ -52,31 +64,32 @@ class LLMController():
                 print_t("[C] Start virtual drone...")
                 self.drone: RobotWrapper = VirtualRobotWrapper()
         
-        self.planner = LLMPlanner(robot_type)
+        self.planner = LLMPlanner(robot_type, llm, self.metrics)
 
         # load low-level skills
         self.low_level_skillset = SkillSet(level="low")
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_forward", self.drone.move_forward, "Move forward by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_backward", self.drone.move_backward, "Move backward by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_left", self.drone.move_left, "Move left by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_right", self.drone.move_right, "Move right by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_up", self.drone.move_up, "Move up by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("move_down", self.drone.move_down, "Move down by a distance", args=[SkillArg("distance", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("turn_cw", self.drone.turn_cw, "Rotate clockwise/right by certain degrees", args=[SkillArg("degrees", int)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("turn_ccw", self.drone.turn_ccw, "Rotate counterclockwise/left by certain degrees", args=[SkillArg("degrees", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_forward", self.after_motion(self.drone.move_forward), "Move forward by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_backward", self.after_motion(self.drone.move_backward), "Move backward by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_left", self.after_motion(self.drone.move_left), "Move left by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_right", self.after_motion(self.drone.move_right), "Move right by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_up", self.after_motion(self.drone.move_up), "Move up by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("move_down", self.after_motion(self.drone.move_down), "Move down by a distance", args=[SkillArg("distance", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("turn_cw", self.after_motion(self.drone.turn_cw), "Rotate clockwise/right by certain degrees", args=[SkillArg("degrees", int)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("turn_ccw", self.after_motion(self.drone.turn_ccw), "Rotate counterclockwise/left by certain degrees", args=[SkillArg("degrees", int)]))
         self.low_level_skillset.add_skill(LowLevelSkillItem("delay", self.skill_delay, "Wait for specified seconds", args=[SkillArg("seconds", float)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("is_visible", self.vision.is_visible, "Check the visibility of target object", args=[SkillArg("object_name", str)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("object_x", self.vision.object_x, "Get object's X-coordinate in (0,1)", args=[SkillArg("object_name", str)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("object_y", self.vision.object_y, "Get object's Y-coordinate in (0,1)", args=[SkillArg("object_name", str)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("object_width", self.vision.object_width, "Get object's width in (0,1)", args=[SkillArg("object_name", str)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("object_height", self.vision.object_height, "Get object's height in (0,1)", args=[SkillArg("object_name", str)]))
-        self.low_level_skillset.add_skill(LowLevelSkillItem("object_dis", self.vision.object_distance, "Get object's distance in cm", args=[SkillArg("object_name", str)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("is_visible", self.vision.is_visible, "Check the visibility of target object", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("object_x", self.vision.object_x, "Get object's X-coordinate in (0,1)", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("object_y", self.vision.object_y, "Get object's Y-coordinate in (0,1)", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("object_width", self.vision.object_width, "Get object's width in (0,1)", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("object_height", self.vision.object_height, "Get object's height in (0,1)", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("object_dis", self.vision.object_distance, "Get object's distance in cm", args=[SkillArg("object_name", str)], pure=True))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("wait_until", self.vision.wait_until, "Wait until the object appears (or '!object' disappears), optionally with constraints like 'x>0.4 x<0.6 dis<80', for at most timeout seconds, returns whether it happened", args=[SkillArg("condition", str), SkillArg("timeout", float)]))
         self.low_level_skillset.add_skill(LowLevelSkillItem("probe", self.planner.probe, "Probe the LLM for reasoning", args=[SkillArg("question", str)]))
         self.low_level_skillset.add_skill(LowLevelSkillItem("log", self.skill_log, "Output text to console", args=[SkillArg("text", str)]))
         self.low_level_skillset.add_skill(LowLevelSkillItem("take_picture", self.skill_take_picture, "Take a picture"))
         self.low_level_skillset.add_skill(LowLevelSkillItem("re_plan", self.skill_re_plan, "Replanning"))
 
-        self.low_level_skillset.add_skill(LowLevelSkillItem("goto", self.skill_goto, "goto the object", args=[SkillArg("object_name[*x-value]", str)]))
+        self.low_level_skillset.add_skill(LowLevelSkillItem("goto", self.after_motion(self.skill_goto), "goto the object", args=[SkillArg("object_name[*x-value]", str)]))
         self.low_level_skillset.add_skill(LowLevelSkillItem("time", self.skill_time, "Get current execution time", args=[]))
         # load high-level skills
         self.high_level_skillset = SkillSet(level="high", lower_level_skillset=self.low_level_skillset)
@@ -89,13 +102,29 @@ class LLMController():
             for skill in json_data:
                 self.high_level_skillset.add_skill(HighLevelSkillItem.load_from_dict(skill))
 
-        Statement.low_level_skillset = self.low_level_skillset
-        Statement.high_level_skillset = self.high_level_skillset
+        self.execution_context = ExecutionContext(self.low_level_skillset, self.high_level_skillset, metrics=self.metrics)
         self.planner.init(high_level_skillset=self.high_level_skillset, low_level_skillset=self.low_level_skillset, vision_skill=self.vision)
 
         self.current_plan = None
         self.execution_history = None
         self.execution_time = time.time()
+        # motion skills in progress, the capture rate goes up while the robot moves
+        self.motions = 0
+        self.capture_rate = CaptureRateController(self.drone.min_capture_fps, self.drone.max_capture_fps)
+        # frames that did not change since the last detected one reuse its result
+        self.frame_gate = FrameGate()
+
+    def after_motion(self, motion: Callable) -> Callable:
+        """Wraps a motion skill, sightings from before the robot moved no longer describe the scene."""
+        def skill(*args):
+            self.motions += 1
+            try:
+                ret = motion(*args)
+            finally:
+                self.motions -= 1
+            self.vision.forget()
+            return ret
+        return skill
 
     def skill_time(self) -> Tuple[float, bool]:
         return time.time() - self.execution_time, False
@@ -142,19 +171,42 @@ class LLMController():
 
     def stop_controller(self):
         self.controller_active = False
+        if isinstance(self.yolo_client, YoloGRPCClient):
+            # also when the capture loop never ran, the client owns a shared memory segment
+            self.yolo_client.close()
 
     def get_latest_frame(self, plot=False):
         image = self.shared_frame.get_image()
         if plot and image:
+            # frames are shared, draw on a copy
+            image = image.copy()
             self.vision.update()
             YoloClient.plot_results_oi(image, self.vision.object_list)
         return image
     
-    def execute_minispec(self, minispec: str):
-        interpreter = MiniSpecInterpreter(self.message_queue)
+    def get_metrics(self) -> dict:
+        """Returns {name: {label: {count, sum, p50, p95, p99}}}, latencies in seconds."""
+        return self.metrics.summary()
+
+    def export_metrics(self, format: str = 'json') -> str:
+        if format == 'json':
+            return self.metrics.to_json()
+        elif format == 'prometheus':
+            return self.metrics.to_prometheus()
+        raise ValueError(f"Unknown metrics format: {format}")
+
+    def dump_metrics(self):
+        with open(os.path.join(self.cache_folder, 'metrics.json'), 'w') as f:
+            f.write(self.export_metrics('json'))
+        with open(os.path.join(self.cache_folder, 'metrics.prom'), 'w') as f:
+            f.write(self.export_metrics('prometheus'))
+
+    def execute_minispec(self, minispec: str | Iterator[ChatCompletion.ChatCompletionChunk]):
+        interpreter = MiniSpecInterpreter(self.execution_context, self.message_queue)
         interpreter.execute(minispec)
         self.execution_history = interpreter.execution_history
         ret_val = interpreter.ret_queue.get()
+        self.timestamp_first_action = interpreter.timestamp_first_action
         return ret_val
 
     def execute_task_description(self, task_description: str):
@@ -164,13 +216,19 @@ class LLMController():
         self.append_message('[TASK]: ' + task_description)
         ret_val = None
         while True:
-            self.current_plan = self.planner.plan(task_description, execution_history=self.execution_history)
+            timestamp_request = time.time()
+            self.timestamp_first_action = None
+            self.current_plan = self.planner.plan(task_description, execution_history=self.execution_history, stream=self.stream_plan)
             self.append_message(f'[Plan]: \\\\')
             try:
                 self.execution_time = time.time()
                 ret_val = self.execute_minispec(self.current_plan)
             except Exception as e:
                 print_t(f"[C] Error: {e}")
+            if self.timestamp_first_action is not None:
+                self.time_to_first_action = self.timestamp_first_action - timestamp_request
+                print_t(f"[C] Time to first action: {self.time_to_first_action:.3f}s")
+                self.metrics.observe('task', 'time_to_first_action', self.time_to_first_action)
             
             # disable replan for debugging
             break
@@ -179,6 +237,7 @@ class LLMController():
                 continue
             else:
                 break
+        self.dump_metrics()
         self.append_message(f'\n[Task ended]')
         self.append_message('end')
         self.current_plan = None
@@ -209,12 +268,27 @@ class LLMController():
             frame = Frame(frame_reader.frame,
                           frame_reader.depth if hasattr(frame_reader, 'depth') else None)
 
-            if self.yolo_client.is_local_service():
+            pose = (self.drone.movement_x_accumulator, self.drone.movement_y_accumulator, self.drone.rotation_accumulator)
+            if not self.frame_gate.should_detect(frame, pose, self.motions > 0):
+                # nothing changed, the detections of the reference frame still describe the scene
+                self.shared_frame.reuse(frame, self.frame_gate.reference_ts)
+            elif isinstance(self.yolo_client, YoloGRPCClient):
+                # never blocks, stale frames are dropped when the service falls behind
+                self.yolo_client.submit(frame)
+            elif self.yolo_client.is_local_service():
                 self.yolo_client.detect_local(frame)
             else:
                 # asynchronously send image to yolo server
                 asyncio_loop.call_soon_threadsafe(asyncio.create_task, self.yolo_client.detect(frame))
-            time.sleep(0.10)
+
+            if isinstance(self.yolo_client, YoloGRPCClient):
+                time.sleep(self.capture_rate.update(self.yolo_client.rtt, self.yolo_client.queue_depth(),
+                                                    self.yolo_client.max_in_flight, self.motions > 0,
+                                                    self.current_plan is not None))
+            else:
+                time.sleep(0.10)
+        if isinstance(self.yolo_client, YoloGRPCClient):
+            self.yolo_client.close()
         # Cancel all running tasks (if any)
         for task in asyncio.all_tasks(asyncio_loop):
             task.cancel()
@@ -5,14 +5,17 @@ from .skillset import SkillSet
 from .llm_wrapper import LLMWrapper, GPT3, GPT4
 from .vision_skill_wrapper import VisionSkillWrapper
 from .utils import print_t
+from .metrics import LatencyMetrics
 from .minispec_interpreter import MiniSpecValueType, evaluate_value
 from .abs.robot_wrapper import RobotType
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class LLMPlanner():
-    def __init__(self, robot_type: RobotType):
-        self.llm = LLMWrapper()
+    def __init__(self, robot_type: RobotType, llm: Optional[LLMWrapper] = None, metrics: Optional[LatencyMetrics] = None):
+        # the LLM client can be shared by the controllers in one process
+        self.llm = llm if llm is not None else LLMWrapper()
+        self.metrics = metrics if metrics is not None else LatencyMetrics()
         self.model_name = GPT4
 
         type_folder_name = 'tello'
@@ -40,7 +43,7 @@ class LLMPlanner():
         self.low_level_skillset = low_level_skillset
         self.vision_skill = vision_skill
 
-    def plan(self, task_description: str, scene_description: Optional[str] = None, error_message: Optional[str] = None, execution_history: Optional[str] = None):
+    def plan(self, task_description: str, scene_description: Optional[str] = None, error_message: Optional[str] = None, execution_history: Optional[str] = None, stream: bool = False):
         # by default, the task_description is an action
         if not task_description.startswith("["):
             task_description = "[A] " + task_description
@@ -56,9 +59,14 @@ class LLMPlanner():
                                              task_description=task_description,
                                              execution_history=execution_history)
         print_t(f"[P] Planning request: {task_description}")
-        return self.llm.request(prompt, self.model_name, stream=False)
+        # with stream=True the plan is returned as chunks so execution can start before generation ends,
+        # the recorded latency is then the time until the stream opens
+        with self.metrics.time('planner', 'plan_stream' if stream else 'plan'):
+            return self.llm.request(prompt, self.model_name, stream=stream)
     
     def probe(self, question: str) -> MiniSpecValueType:
         prompt = self.prompt_probe.format(scene_description=self.vision_skill.get_obj_list(), question=question)
         print_t(f"[P] Execution request: {question}")
-        return evaluate_value(self.llm.request(prompt, self.model_name)), False
\ No newline at end of file
+        with self.metrics.time('planner', 'probe'):
+            response = self.llm.request(prompt, self.model_name)
+        return evaluate_value(response), False
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+from typing import Iterator
 import openai
 from openai import Stream, ChatCompletion
 
@@ -21,7 +22,7 @@ class LLMWrapper:
             api_key=os.environ.get("OPENAI_API_KEY"),
         )
 
-    def request(self, prompt, model_name=GPT4, stream=False) -> str | Stream[ChatCompletion.ChatCompletionChunk]:
+    def request(self, prompt, model_name=GPT4, stream=False) -> str | Iterator[ChatCompletion.ChatCompletionChunk]:
         if model_name == LLAMA3:
             client = self.llama_client
         else:
@@ -41,6 +42,16 @@ class LLMWrapper:
                 f.write(response.model_dump_json(indent=2) + "\n---\n")
 
         if stream:
-            return response
+            return LLMWrapper.log_stream(response)
 
-        return response.choices[0].message.content
\ No newline at end of file
+        return response.choices[0].message.content
+
+    def log_stream(response: Stream[ChatCompletion.ChatCompletionChunk]) -> Iterator[ChatCompletion.ChatCompletionChunk]:
+        # pass chunks through as they arrive and log the full response at the end
+        content = ''
+        for chunk in response:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None:
+                content += chunk.choices[0].delta.content
+            yield chunk
+        with open(chat_log_path, "a") as f:
+            f.write(content + "\n---\n")
\ No newline at end of file
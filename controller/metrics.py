@@ -0,0 +1,97 @@
+import json, math, time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, Optional, Tuple
+
+'''
+In-process latency histograms. Every series is identified by a metric name and a
+label (e.g. ('skill', 'move_forward')) and keeps the most recent samples, so
+percentiles reflect the current session rather than the whole process lifetime.
+'''
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def nearest_rank(ordered: list, q: float) -> Optional[float]:
+    if len(ordered) == 0:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+class Histogram:
+    def __init__(self, window: int = 4096):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        return nearest_rank(sorted(self.samples), q)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+        summary = {'count': self.count, 'sum': self.sum}
+        for q in QUANTILES:
+            summary[f'p{int(q * 100)}'] = nearest_rank(ordered, q)
+        return summary
+
+class LatencyMetrics:
+    def __init__(self, window: int = 4096):
+        self.window = window
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.lock = Lock()
+
+    def observe(self, name: str, label: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get((name, label))
+            if histogram is None:
+                histogram = Histogram(self.window)
+                self.histograms[(name, label)] = histogram
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, label: str) -> Iterator[None]:
+        """Records the duration of the with-block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, label, time.perf_counter() - start)
+
+    def get(self, name: str, label: str) -> Optional[dict]:
+        with self.lock:
+            histogram = self.histograms.get((name, label))
+            return histogram.summary() if histogram is not None else None
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        """Returns {name: {label: {count, sum, p50, p95, p99}}} in seconds."""
+        result = {}
+        with self.lock:
+            for (name, label), histogram in sorted(self.histograms.items()):
+                result.setdefault(name, {})[label] = histogram.summary()
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'typefly') -> str:
+        """Prometheus text exposition format, one summary per metric name."""
+        lines = []
+        for name, series in self.summary().items():
+            metric = f'{prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for label, summary in series.items():
+                label = label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                for q in QUANTILES:
+                    value = summary[f'p{int(q * 100)}']
+                    lines.append(f'{metric}{{name="{label}",quantile="{q}"}} {"NaN" if value is None else value}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {summary["sum"]}')
+                lines.append(f'{metric}_count{{name="{label}"}} {summary["count"]}')
+        return '\n'.join(lines) + '\n'
@@ -1,13 +1,19 @@
-from typing import List, Tuple, Union
-import re, queue
+from typing import Callable, FrozenSet, Iterator, List, Tuple, Union
+import queue, copy
 from enum import Enum
+from functools import lru_cache
 import time
 from typing import Optional
-from threading import Thread
+from threading import Thread, Condition, Event
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from openai import ChatCompletion, Stream
-from .skillset import SkillSet
-from .utils import split_args, print_t
+from .skillset import SkillSet, HighLevelSkillItem
+from .utils import print_t
+from .metrics import LatencyMetrics
+from .minispec_parser import Node, Literal, Variable, Parameter, Call, BinaryOp, Compare, BoolOp, Assign, Return, Program, If, Loop, \
+    BUILTIN_FUNCTIONS, parse_program, parse_statement, parse_condition, walk
+from .minispec_optimizer import validate, check_statement, optimize
 
 
 def print_debug(*args):
@@ -16,6 +22,9 @@ def print_debug(*args):
 
 MiniSpecValueType = Union[int, float, bool, str, None]
 
+# threads shared by the concurrent evaluation of pure skills, e.g. is_visible
+PERCEPTION_WORKERS = 8
+
 def evaluate_value(value: str) -> MiniSpecValueType:
     if value.isdigit():
         return int(value)
@@ -31,43 +40,385 @@ def evaluate_value(value: str) -> MiniSpecValueType:
         return value.strip('\'"')
 
 class MiniSpecReturnValue:
-    def __init__(self, value: MiniSpecValueType, replan: bool):
+    def __init__(self, value: MiniSpecValueType, replan: bool, ret: bool = False):
         self.value = value
         self.replan = replan
+        # set when the value comes from a `->` statement
+        self.ret = ret
 
     def from_tuple(t: Tuple[MiniSpecValueType, bool]):
         return MiniSpecReturnValue(t[0], t[1])
-    
+
     def default():
         return MiniSpecReturnValue(None, False)
-    
+
     def __repr__(self) -> str:
         return f'value={self.value}, replan={self.replan}'
-    
+
+class ExecutionContext:
+    """
+    Interpreter state of one controller session. Threading it through programs,
+    statements and compiled code (instead of class-level globals) lets one process
+    run several controllers concurrently.
+    """
+    def __init__(self, low_level_skillset: SkillSet, high_level_skillset: SkillSet,
+                 execution_queue: Optional[Queue] = None, perception_pool: Optional[ThreadPoolExecutor] = None,
+                 metrics: Optional[LatencyMetrics] = None):
+        self.low_level_skillset = low_level_skillset
+        self.high_level_skillset = high_level_skillset
+        # top-level statements are queued here as soon as they are parsed
+        self.execution_queue = execution_queue
+        if perception_pool is None:
+            perception_pool = ThreadPoolExecutor(max_workers=PERCEPTION_WORKERS, thread_name_prefix='perception')
+        self.perception_pool = perception_pool
+        # latency of statements and skill calls
+        self.metrics = metrics if metrics is not None else LatencyMetrics()
+
+    def for_execution(self) -> 'ExecutionContext':
+        """Returns a context sharing the skillsets with a fresh execution queue."""
+        return ExecutionContext(self.low_level_skillset, self.high_level_skillset, Queue(), self.perception_pool, self.metrics)
+
+    def sequential(self) -> 'ExecutionContext':
+        """Returns a context that evaluates everything on the calling thread."""
+        ctx = copy.copy(self)
+        ctx.perception_pool = None
+        return ctx
+
+    def skillset_versions(self) -> Tuple[int, int]:
+        """Part of the key of every cache of code validated against the skillsets."""
+        return self.low_level_skillset.version, self.high_level_skillset.version
+
+    def is_pure(self, skill_names: FrozenSet[str]) -> bool:
+        """True if calling the skills has no side effects, i.e. they are all pure low-level skills."""
+        return self.low_level_skillset.all_pure(skill_names)
+
+'''
+Compiled MiniSpec: every AST node is turned into a closure taking the execution
+context and the variable environment, so a statement is tokenized and parsed exactly once no matter how
+many times it runs (e.g. inside a loop).
+'''
+Evaluator = Callable[['ExecutionContext', dict], MiniSpecReturnValue]
+
+def compare_values(comparator: str, value_1: MiniSpecValueType, value_2: MiniSpecValueType) -> bool:
+    if type(value_1) == int and type(value_2) == float or \
+        type(value_1) == float and type(value_2) == int:
+        value_1 = float(value_1)
+        value_2 = float(value_2)
+
+    if type(value_1) != type(value_2):
+        if comparator == '!=':
+            return True
+        elif comparator == '==':
+            return False
+        else:
+            raise Exception(f'Invalid comparator: {value_1}:{type(value_1)} {value_2}:{type(value_2)}')
+
+    if comparator == '>':
+        return value_1 > value_2
+    elif comparator == '<':
+        return value_1 < value_2
+    elif comparator == '==':
+        return value_1 == value_2
+    elif comparator == '!=':
+        return value_1 != value_2
+    raise Exception(f'Invalid comparator: {comparator}')
+
+ARITHMETIC_OPERATORS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+}
+
+NO_SKILLS: FrozenSet[str] = frozenset()
+
+def called_skills(node: Node) -> FrozenSet[str]:
+    """Names of the skills the node calls, computed once when it is compiled."""
+    if isinstance(node, (Literal, Variable)):
+        # most operands, e.g. the arguments of motions
+        return NO_SKILLS
+    return frozenset(child.name for child in walk(node) if isinstance(child, Call) and child.name not in BUILTIN_FUNCTIONS)
+
+def evaluate_operands(ctx: 'ExecutionContext', env: dict, skills: List[FrozenSet[str]],
+                      operands: List[Evaluator]) -> Iterator[MiniSpecReturnValue]:
+    """
+    Yields the value of each operand in order. The leading pure operands that call
+    skills are started together on the perception pool; closing the generator early
+    (short-circuit) cancels the ones that have not started yet.
+    """
+    futures = {}
+    if ctx.perception_pool is not None:
+        for i, names in enumerate(skills):
+            # an impure operand may change what later operands observe
+            if not ctx.is_pure(names):
+                break
+            if len(names) > 0:
+                futures[i] = operands[i]
+        if len(futures) > 1:
+            # nested operands run on the worker thread, so workers never wait on each other
+            worker_ctx = ctx.sequential()
+            futures = {i: ctx.perception_pool.submit(operand, worker_ctx, env) for i, operand in futures.items()}
+        else:
+            futures = {}
+    try:
+        for i, operand in enumerate(operands):
+            yield futures[i].result() if i in futures else operand(ctx, env)
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+def call_skill(ctx: 'ExecutionContext', name: str, args: List[MiniSpecValueType]) -> MiniSpecReturnValue:
+    if name in BUILTIN_FUNCTIONS:
+        return MiniSpecReturnValue(BUILTIN_FUNCTIONS[name](args[0]), False)
+
+    skill_instance = ctx.low_level_skillset.get_skill(name)
+    if skill_instance is not None:
+        print_debug(f'Executing low-level skill: {skill_instance.get_name()} {args}')
+        with ctx.metrics.time('skill', skill_instance.get_name()):
+            return MiniSpecReturnValue.from_tuple(skill_instance.execute(args))
+
+    skill_instance = ctx.high_level_skillset.get_skill(name)
+    if skill_instance is not None:
+        print_debug(f'Executing high-level skill: {skill_instance.get_name()}', args)
+        # each call runs in its own variable scope
+        with ctx.metrics.time('skill', skill_instance.get_name()):
+            val = compile_high_level_skill(skill_instance, tuple(args), ctx.low_level_skillset,
+                                           ctx.high_level_skillset, ctx.skillset_versions())(ctx, {})
+        if val.value == 'rp':
+            return MiniSpecReturnValue(f'High-level skill {skill_instance.get_name()} failed', True)
+        if val.ret:
+            # `->` returns from the high-level skill, not from the caller
+            return MiniSpecReturnValue(val.value, False)
+        return val
+    raise Exception(f'Skill {name} is not defined')
+
+def statement_kind(node: Node) -> str:
+    """The label of the statement's latency metric, as Statement.eval() records it."""
+    return 'if' if isinstance(node, If) else 'loop' if isinstance(node, Loop) else 'expr'
+
+def time_statement(evaluator: Evaluator, kind: str) -> Evaluator:
+    def eval_timed(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+        with ctx.metrics.time('statement', kind):
+            return evaluator(ctx, env)
+    return eval_timed
+
+def compile_node(node: Node, timed: bool = False) -> Evaluator:
+    """`timed` records the latency of the statements in blocks, as the streamed path does for plans."""
+    if isinstance(node, Literal):
+        ret_val = MiniSpecReturnValue(node.value, False)
+        return lambda ctx, env: ret_val
+
+    if isinstance(node, Variable):
+        name = node.name
+        def eval_variable(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            if name not in env:
+                raise Exception(f'Variable {name} is not defined')
+            return MiniSpecReturnValue(env[name], False)
+        return eval_variable
+
+    if isinstance(node, Call):
+        name = node.name
+        arg_skills = [called_skills(arg) for arg in node.args]
+        arg_evaluators = [compile_node(arg) for arg in node.args]
+        def eval_call(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            args = []
+            for ret_val in evaluate_operands(ctx, env, arg_skills, arg_evaluators):
+                if ret_val.replan:
+                    return ret_val
+                args.append(ret_val.value)
+            return call_skill(ctx, name, args)
+        return eval_call
+
+    if isinstance(node, BinaryOp):
+        operator = ARITHMETIC_OPERATORS[node.op]
+        skills = [called_skills(node.left), called_skills(node.right)]
+        evaluators = [compile_node(node.left), compile_node(node.right)]
+        def eval_binary(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            values = evaluate_operands(ctx, env, skills, evaluators)
+            operand_1 = next(values)
+            if operand_1.replan:
+                return operand_1
+            operand_2 = next(values)
+            if operand_2.replan:
+                return operand_2
+            return MiniSpecReturnValue(operator(operand_1.value, operand_2.value), False)
+        return eval_binary
+
+    if isinstance(node, Compare):
+        comparator = node.op
+        skills = [called_skills(node.left), called_skills(node.right)]
+        evaluators = [compile_node(node.left), compile_node(node.right)]
+        def eval_compare(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            values = evaluate_operands(ctx, env, skills, evaluators)
+            operand_1 = next(values)
+            if operand_1.replan:
+                return operand_1
+            operand_2 = next(values)
+            if operand_2.replan:
+                return operand_2
+            print_debug(f'Condition ops: {operand_1.value} {comparator} {operand_2.value}')
+            return MiniSpecReturnValue(compare_values(comparator, operand_1.value, operand_2.value), False)
+        return eval_compare
+
+    if isinstance(node, BoolOp):
+        # both operators short-circuit once the result is decided
+        stop_on = node.op == '|'
+        skills = [called_skills(operand) for operand in node.operands]
+        operands = [compile_node(operand) for operand in node.operands]
+        def eval_bool(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            for ret_val in evaluate_operands(ctx, env, skills, operands):
+                if ret_val.replan:
+                    return ret_val
+                if bool(ret_val.value) == stop_on:
+                    return MiniSpecReturnValue(stop_on, False)
+            return MiniSpecReturnValue(not stop_on, False)
+        return eval_bool
+
+    if isinstance(node, Assign):
+        name = node.name
+        value = compile_node(node.value)
+        def eval_assign(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            ret_val = value(ctx, env)
+            env[name] = ret_val.value
+            return ret_val
+        return eval_assign
+
+    if isinstance(node, Return):
+        value = compile_node(node.value)
+        def eval_return(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            return MiniSpecReturnValue(value(ctx, env).value, True, True)
+        return eval_return
+
+    if isinstance(node, Program):
+        statements = [compile_node(statement, timed) for statement in node.statements]
+        if timed:
+            statements = [time_statement(evaluator, statement_kind(statement))
+                          for evaluator, statement in zip(statements, node.statements)]
+        def eval_program(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            ret_val = MiniSpecReturnValue.default()
+            for statement in statements:
+                ret_val = statement(ctx, env)
+                if ret_val.replan or ret_val.ret:
+                    return ret_val
+            return ret_val
+        return eval_program
+
+    if isinstance(node, If):
+        condition, body = compile_node(node.condition), compile_node(node.body, timed)
+        def eval_if(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            ret_val = condition(ctx, env)
+            if ret_val.replan:
+                return ret_val
+            if ret_val.value:
+                return body(ctx, env)
+            return MiniSpecReturnValue.default()
+        return eval_if
+
+    if isinstance(node, Loop):
+        count, body = node.count, compile_node(node.body, timed)
+        def eval_loop(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+            ret_val = MiniSpecReturnValue.default()
+            for _ in range(count):
+                ret_val = body(ctx, env)
+                if ret_val.replan or ret_val.ret:
+                    return ret_val
+            return ret_val
+        return eval_loop
+
+    if isinstance(node, Parameter):
+        raise Exception(f'Unbound parameter {node} outside a high-level skill')
+
+    raise Exception(f'Unsupported node: {node}')
+
+def compile_error(e: Exception) -> Evaluator:
+    # syntax errors surface when the statement runs, like any other runtime error
+    def raise_error(ctx: 'ExecutionContext', env: dict) -> MiniSpecReturnValue:
+        raise e
+    return raise_error
+
+# compiled code resolves skills through the context when it runs, only the caches of
+# validated code depend on the skillsets and key on them and their versions
+
+@lru_cache(maxsize=256)
+def compile_program(code: str) -> Evaluator:
+    return compile_node(parse_program(code))
+
+@lru_cache(maxsize=256)
+def compile_high_level_skill(skill: HighLevelSkillItem, args: Tuple[MiniSpecValueType, ...],
+                             low_level_skillset: SkillSet, high_level_skillset: SkillSet,
+                             versions: Tuple[int, int]) -> Evaluator:
+    """Compiles the skill's pre-parsed template specialised for one argument list, validated against the skillsets."""
+    program = validate(skill.execute(list(args)), low_level_skillset, high_level_skillset)
+    return compile_node(optimize(program))
+
+# the compiled statements and conditions also return their tree, None if there is nothing to validate
+
+@lru_cache(maxsize=1024)
+def compile_statement(code: str) -> Tuple[Optional[Node], Evaluator]:
+    try:
+        node = parse_statement(code)
+    except Exception as e:
+        return None, compile_error(e)
+    if node is None:
+        return None, lambda ctx, env: MiniSpecReturnValue.default()
+    return node, compile_node(node)
+
+@lru_cache(maxsize=1024)
+def compile_condition(code: str) -> Tuple[Optional[Node], Evaluator]:
+    try:
+        node = parse_condition(code)
+        return node, compile_node(node)
+    except Exception as e:
+        return None, compile_error(e)
+
+@lru_cache(maxsize=1024)
+def check_streamed(code: str, condition: bool, low_level_skillset: SkillSet, high_level_skillset: SkillSet,
+                   versions: Tuple[int, int], assigned: FrozenSet[str]) -> Tuple[FrozenSet[str], Optional[str]]:
+    """
+    Validates a streamed statement or condition, given the variables assigned before it.
+    Returns the variables it assigns and the problem, None if it is valid.
+    """
+    node, _ = compile_condition(code) if condition else compile_statement(code)
+    if node is None:
+        # empty, or the evaluator raises the syntax error already
+        return frozenset(), None
+    assigns = frozenset(child.name for child in walk(node) if isinstance(child, Assign))
+    try:
+        check_statement(node, low_level_skillset, high_level_skillset, assigned | assigns)
+    except ValueError as e:
+        return assigns, str(e)
+    return assigns, None
+
 class ParsingState(Enum):
     CODE = 0
-    ARGUMENTS = 1
-    CONDITION = 2
-    LOOP_COUNT = 3
-    SUB_STATEMENTS = 4
+    SUB_STATEMENTS = 1
 
 class MiniSpecProgram:
-    def __init__(self, env: Optional[dict] = None, mq: queue.Queue = None) -> None:
+    def __init__(self, context: ExecutionContext, env: Optional[dict] = None, mq: queue.Queue = None,
+                 assigned: Optional[set] = None) -> None:
+        self.context = context
         self.statements: List[Statement] = []
-        self.depth = 0
         self.finished = False
+        # set when the plan stream failed before this program was closed
+        self.aborted = False
         self.ret = False
         if env is None:
             self.env = {}
         else:
             self.env = env
-        self.current_statement = Statement(self.env)
+        # variables assigned by the statements parsed so far, shared with nested blocks
+        self.assigned = set() if assigned is None else assigned
+        self.current_statement = Statement(self.context, self.env, self.assigned)
         self.mq = mq
+        # notified whenever a statement is added or the program is finished
+        self.updated = Condition()
 
     def parse(self, code_instance: Stream[ChatCompletion.ChatCompletionChunk] | List[str], exec: bool = False) -> bool:
         for chunk in code_instance:
             if isinstance(chunk, str):
                 code = chunk
+            elif len(chunk.choices) == 0:
+                continue
             else:
                 code = chunk.choices[0].delta.content
             if code == None or len(code) == 0:
@@ -75,43 +426,75 @@ class MiniSpecProgram:
             if self.mq:
                 self.mq.put(code + '\\\\')
             for c in code:
-                if self.current_statement.parse(c, exec):
-                    if len(self.current_statement.action) > 0:
-                        print_debug("Adding statement: ", self.current_statement, exec)
-                        self.statements.append(self.current_statement)
-                    self.current_statement = Statement(self.env)
-                if c == '{':
-                    self.depth += 1
-                elif c == '}':
-                    if self.depth == 0:
-                        self.finished = True
-                        return True
-                    self.depth -= 1
+                if self.parse_char(c, exec):
+                    return True
+        self.close(exec)
         return False
-    
+
+    def close(self, exec: bool = False):
+        """Ends the program at the end of input, including a trailing statement without ';'."""
+        if self.current_statement.flush(exec):
+            self.add_statement(exec)
+        self.set_finished()
+
+    def set_finished(self):
+        with self.updated:
+            self.finished = True
+            self.updated.notify_all()
+
+    def abort(self):
+        """Finishes this program and every block still open in it, an evaluation waiting for more statements stops."""
+        for statement in self.statements + [self.current_statement]:
+            if statement.sub_statements is not None and not statement.sub_statements.finished:
+                statement.sub_statements.abort()
+        with self.updated:
+            self.aborted = True
+            self.finished = True
+            self.updated.notify_all()
+
+    def parse_char(self, c: str, exec: bool = False) -> bool:
+        """Feeds one character, returns True once the closing '}' of this program is consumed."""
+        if self.current_statement.ends_before(c):
+            self.current_statement.flush(exec)
+            self.add_statement(exec)
+        if self.current_statement.parse(c, exec):
+            closed = self.current_statement.closed_program
+            self.add_statement(exec)
+            if closed:
+                self.set_finished()
+                return True
+        return False
+
+    def add_statement(self, exec: bool):
+        if len(self.current_statement.action) > 0:
+            print_debug("Adding statement: ", self.current_statement, exec)
+            with self.updated:
+                self.statements.append(self.current_statement)
+                self.updated.notify_all()
+        self.current_statement = Statement(self.context, self.env, self.assigned)
+
     def eval(self) -> MiniSpecReturnValue:
         print_debug(f'Eval program: {self}, finished: {self.finished}')
         ret_val = MiniSpecReturnValue.default()
         count = 0
-        while not self.finished:
-            if len(self.statements) <= count:
-                time.sleep(0.1)
-                continue
-            ret_val = self.statements[count].eval()
-            if ret_val.replan or self.statements[count].ret:
-                print_debug(f'RET from {self.statements[count]} with {ret_val} {self.statements[count].ret}')
+        while True:
+            # block until the parser adds the next statement or finishes the program
+            with self.updated:
+                while len(self.statements) <= count and not self.finished:
+                    self.updated.wait()
+                if len(self.statements) <= count:
+                    if self.aborted:
+                        # the rest of the block never arrived, stop rather than run what there is of it
+                        return MiniSpecReturnValue('Plan stream ended inside a block', True)
+                    return ret_val
+                statement = self.statements[count]
+            ret_val = statement.eval()
+            if ret_val.replan or statement.ret:
+                print_debug(f'RET from {statement} with {ret_val} {statement.ret}')
                 self.ret = True
                 return ret_val
             count += 1
-        if count < len(self.statements):
-            for i in range(count, len(self.statements)):
-                ret_val = self.statements[i].eval()
-                if ret_val.replan or self.statements[i].ret:
-                    print_debug(f'RET from {self.statements[i]} with {ret_val} {self.statements[i].ret}')
-                    self.ret = True
-                    return ret_val
-        return ret_val
-    
+
     def __repr__(self) -> str:
         s = ''
         for statement in self.statements:
@@ -119,86 +502,120 @@ class MiniSpecProgram:
         return s
 
 class Statement:
-    execution_queue: Queue['Statement'] = None
-    low_level_skillset: SkillSet = None
-    high_level_skillset: SkillSet = None
-    def __init__(self, env: dict) -> None:
+    def __init__(self, context: ExecutionContext, env: dict, assigned: set) -> None:
+        self.context = context
         self.code_buffer: str = ''
         self.parsing_state: ParsingState = ParsingState.CODE
         self.condition: Optional[str] = None
         self.loop_count: Optional[int] = None
         self.action: str = ''
-        self.allow_digit: bool = False
-        self.executable: bool = False
+        self.executable = Event()
         self.ret: bool = False
         self.sub_statements: Optional[MiniSpecProgram] = None
         self.env = env
-        self.read_argument: bool = False
+        self.assigned = assigned
+        self.evaluator: Optional[Evaluator] = None
+        # set when the statement was ended by the '}' closing the enclosing program
+        self.closed_program: bool = False
+        self.quote: Optional[str] = None
+        self.paren_depth: int = 0
+        self.call_closed: bool = False
+
+    def ends_before(self, c: str) -> bool:
+        """A statement may omit ';' after a call, e.g. `g('apple')l('done')`."""
+        return self.parsing_state == ParsingState.CODE and self.call_closed and \
+            not c.isspace() and c not in '+-*/<>=!&|;{}'
 
-    def get_env_value(self, var) -> MiniSpecValueType:
-        if var not in self.env:
-            raise Exception(f'Variable {var} is not defined')
-        return self.env[var]
+    def flush(self, exec: bool = False) -> bool:
+        if self.parsing_state == ParsingState.SUB_STATEMENTS:
+            # unterminated block, e.g. a truncated response
+            self.sub_statements.close()
+            return True
+        if len(self.code_buffer.strip()) == 0:
+            return False
+        self.set_action(exec)
+        return True
+
+    def set_action(self, exec: bool):
+        self.action = self.code_buffer.strip()
+        print_debug(f'SP Action: {self.action}')
+        self.evaluator = self.validated(self.action, False, compile_statement(self.action)[1])
+        self.executable.set()
+        if exec and self.action != '':
+            self.context.execution_queue.put(self)
 
     def parse(self, code: str, exec: bool = False) -> bool:
         for c in code:
             match self.parsing_state:
                 case ParsingState.CODE:
-                    if c == '?' and not self.read_argument:
-                        self.action = 'if'
-                        self.parsing_state = ParsingState.CONDITION
-                    elif c == ';' or c == '}' or c == ')':
-                        if c == ')':
-                            self.code_buffer += c
-                            self.read_argument = False
-                        self.action = self.code_buffer
-                        print_debug(f'SP Action: {self.code_buffer}')
-                        self.executable = True
-                        if exec and self.action != '':
-                            self.execution_queue.put(self)
-                        return True
-                    else:
-                        if c == '(':
-                            self.read_argument = True
-                        if c.isalpha() or c == '_':
-                            self.allow_digit = True
+                    if not c.isspace():
+                        self.call_closed = False
+                    if self.quote is not None:
+                        if c == self.quote:
+                            self.quote = None
                         self.code_buffer += c
-                    if c.isdigit() and not self.allow_digit:
-                        self.action = 'loop'
-                        self.parsing_state = ParsingState.LOOP_COUNT
-                case ParsingState.CONDITION:
-                    if c == '{':
-                        print_debug(f'SP Condition: {self.code_buffer}')
-                        self.condition = self.code_buffer
-                        self.executable = True
-                        if exec:
-                            self.execution_queue.put(self)
-                        self.sub_statements = MiniSpecProgram(self.env)
-                        self.parsing_state = ParsingState.SUB_STATEMENTS
-                    else:
+                    elif c == '\'' or c == '"':
+                        self.quote = c
+                        self.code_buffer += c
+                    elif c == '(':
+                        self.paren_depth += 1
                         self.code_buffer += c
-                case ParsingState.LOOP_COUNT:
-                    if c == '{':
-                        print_debug(f'SP Loop: {self.code_buffer}')
-                        self.loop_count = int(self.code_buffer)
-                        self.executable = True
+                    elif c == ')':
+                        self.paren_depth -= 1
+                        self.code_buffer += c
+                        self.call_closed = self.paren_depth == 0
+                    elif c == ';' or c == '}':
+                        self.closed_program = c == '}'
+                        self.set_action(exec)
+                        return True
+                    elif c == '{':
+                        header = self.code_buffer.strip()
+                        if header.startswith('?'):
+                            print_debug(f'SP Condition: {header[1:]}')
+                            self.action = 'if'
+                            self.condition = header[1:]
+                            self.evaluator = self.validated(self.condition, True, compile_condition(self.condition)[1])
+                        elif header.isdigit():
+                            print_debug(f'SP Loop: {header}')
+                            self.action = 'loop'
+                            self.loop_count = int(header)
+                        else:
+                            raise Exception(f'Invalid block statement: {header}')
+                        self.executable.set()
                         if exec:
-                            self.execution_queue.put(self)
-                        self.sub_statements = MiniSpecProgram(self.env)
+                            self.context.execution_queue.put(self)
+                        self.sub_statements = MiniSpecProgram(self.context, self.env, assigned=self.assigned)
                         self.parsing_state = ParsingState.SUB_STATEMENTS
                     else:
                         self.code_buffer += c
                 case ParsingState.SUB_STATEMENTS:
-                    if self.sub_statements.parse([c]):
+                    if self.sub_statements.parse_char(c):
                         return True
         return False
-    
+
+    def validated(self, code: str, condition: bool, evaluator: Evaluator) -> Evaluator:
+        """
+        Checks a streamed statement as prepare() checks a complete plan. An invalid one
+        raises when it runs, so the plan ends with a replan before the statement acts.
+        """
+        assigns, error = check_streamed(code, condition, self.context.low_level_skillset, self.context.high_level_skillset,
+                                        self.context.skillset_versions(), frozenset(self.assigned))
+        self.assigned.update(assigns)
+        if error is not None:
+            return compile_error(ValueError(f'Invalid plan: {error}'))
+        return evaluator
+
     def eval(self) -> MiniSpecReturnValue:
         print_debug(f'Statement eval: {self} {self.action} {self.condition} {self.loop_count}')
-        while not self.executable:
-            time.sleep(0.1)
+        self.executable.wait()
+        # time the statement itself, not the wait for the parser
+        kind = self.action if self.action in ('if', 'loop') else 'expr'
+        with self.context.metrics.time('statement', kind):
+            return self.eval_action()
+
+    def eval_action(self) -> MiniSpecReturnValue:
         if self.action == 'if':
-            ret_val = self.eval_condition(self.condition)
+            ret_val = self.evaluator(self.context, self.env)
             if ret_val.replan:
                 return ret_val
             if ret_val.value:
@@ -220,170 +637,10 @@ class Statement:
                     return ret_val
             return ret_val
         else:
-            self.ret = False
-            return self.eval_expr(self.action)
-    
-    # def eval_action(self, action: str) -> MiniSpecReturnValue:
-    #     action = action.strip()
-    #     print_debug(f'Eval action: {action}')
-        
-    #     if '=' in action:
-    #         var, expr = action.split('=')
-    #         print_debug(f'Assignment: Var: {var.strip()}, Val: {expr.strip()}')
-    #         expr = expr.strip()
-    #         ret_val = self.eval_function(expr.strip())
-    #         if not ret_val.replan:
-    #             self.env[var.strip()] = ret_val.value
-    #         return ret_val
-    #     elif action.startswith('->'):
-    #         self.ret = True
-    #         return self.eval_expr(action.lstrip("->"))
-    #     else:
-    #         return self.eval_function(action)
-
-    def eval_function(self, func: str) -> MiniSpecReturnValue:
-        print_debug(f'Eval function: {func}')
-        # append to execution state queue
-        func = func.split('(', 1)
-        name = func[0].strip()
-        if len(func) == 2:
-            args = func[1].strip()[:-1]
-            args = split_args(args)
-            for i in range(0, len(args)):
-                args[i] = args[i].strip().strip('\'"')
-                if args[i].startswith('_'):
-                    args[i] = self.get_env_value(args[i])
-        else:
-            args = []
-
-        if name == 'int':
-            return MiniSpecReturnValue(int(args[0]), False)
-        elif name == 'float':
-            return MiniSpecReturnValue(float(args[0]), False)
-        elif name == 'str':
-            return MiniSpecReturnValue(args[0], False)
-        else:
-            skill_instance = Statement.low_level_skillset.get_skill(name)
-            if skill_instance is not None:
-                print_debug(f'Executing low-level skill: {skill_instance.get_name()} {args}')
-                return MiniSpecReturnValue.from_tuple(skill_instance.execute(args))
-
-            skill_instance = Statement.high_level_skillset.get_skill(name)
-            if skill_instance is not None:
-                print_debug(f'Executing high-level skill: {skill_instance.get_name()}', args, skill_instance.execute(args))
-                interpreter = MiniSpecProgram()
-                interpreter.parse([skill_instance.execute(args)])
-                interpreter.finished = True
-                val = interpreter.eval()
-                if val.value == 'rp':
-                    return MiniSpecReturnValue(f'High-level skill {skill_instance.get_name()} failed', True)
-                return val
-            raise Exception(f'Skill {name} is not defined')
-
-    def eval_expr(self, var: str) -> MiniSpecReturnValue:
-        print_t(f'Eval expr: {var}')
-        var = var.strip()
-        if var.startswith('->'):
-            self.ret = True
-            return MiniSpecReturnValue(self.eval_expr(var.lstrip('->')).value, True)
-        if '=' in var:
-            
-            var, expr = var.split('=')
-            print_t(f'Eval expr var assign: {var} {expr}')
-            expr = expr.strip()
-            ret_val = self.eval_expr(expr)
-            # if not ret_val.replan:
-            self.env[var] = ret_val.value
+            print_t(f'Eval expr: {self.action}')
+            ret_val = self.evaluator(self.context, self.env)
+            self.ret = ret_val.ret
             return ret_val
-        # deal with + - * / operators
-        if '+' in var or '-' in var or '*' in var or '/' in var:
-            if '+' in var:
-                operands = var.split('+')
-                val = 0
-                for operand in operands:
-                    val += self.eval_expr(operand).value
-            elif '-' in var:
-                operands = var.split('-')
-                val = self.eval_expr(operands[0]).value
-                for operand in operands[1:]:
-                    val -= self.eval_expr(operand).value
-            elif '*' in var:
-                operands = var.split('*')
-                val = 1
-                for operand in operands:
-                    val *= self.eval_expr(operand).value
-            elif '/' in var:
-                operands = var.split('/')
-                val = self.eval_expr(operands[0]).value
-                for operand in operands[1:]:
-                    val /= self.eval_expr(operand).value
-            return MiniSpecReturnValue(val, False)
-
-        if len(var) == 0:
-            raise Exception('Empty operand')
-        if var.startswith('_'):
-            return MiniSpecReturnValue(self.get_env_value(var), False)
-        elif var == 'True' or var == 'False':
-            return MiniSpecReturnValue(evaluate_value(var), False)
-        elif var[0].isalpha():
-            return self.eval_function(var)
-        else:
-            return MiniSpecReturnValue(evaluate_value(var), False)
-
-    def eval_condition(self, condition: str) -> MiniSpecReturnValue:
-        if '&' in condition:
-            conditions = condition.split('&')
-            cond = True
-            for c in conditions:
-                ret_val = self.eval_condition(c)
-                if ret_val.replan:
-                    return ret_val
-                cond = cond and ret_val.value
-            return MiniSpecReturnValue(cond, False)
-        if '|' in condition:
-            conditions = condition.split('|')
-            for c in conditions:
-                ret_val = self.eval_condition(c)
-                if ret_val.replan:
-                    return ret_val
-                if ret_val.value == True:
-                    return MiniSpecReturnValue(True, False)
-            return MiniSpecReturnValue(False, False)
-        
-        operand_1, comparator, operand_2 = re.split(r'(>|<|==|!=)', condition)
-        operand_1 = self.eval_expr(operand_1)
-        if operand_1.replan:
-            return operand_1
-        operand_2 = self.eval_expr(operand_2)
-        if operand_2.replan:
-            return operand_2
-        
-        print_debug(f'Condition ops: {operand_1.value} {comparator} {operand_2.value}')
-        if type(operand_1.value) == int and type(operand_2.value) == float or \
-            type(operand_1.value) == float and type(operand_2.value) == int:
-            operand_1.value = float(operand_1.value)
-            operand_2.value = float(operand_2.value)
-
-        if type(operand_1.value) != type(operand_2.value):
-            if comparator == '!=':
-                return MiniSpecReturnValue(True, False)
-            elif comparator == '==':
-                return MiniSpecReturnValue(False, False)
-            else:
-                raise Exception(f'Invalid comparator: {operand_1.value}:{type(operand_1.value)} {operand_2.value}:{type(operand_2.value)}')
-
-        if comparator == '>':
-            cmp = operand_1.value > operand_2.value
-        elif comparator == '<':
-            cmp = operand_1.value < operand_2.value
-        elif comparator == '==':
-            cmp = operand_1.value == operand_2.value
-        elif comparator == '!=':
-            cmp = operand_1.value != operand_2.value
-        else:
-            raise Exception(f'Invalid comparator: {comparator}')
-        
-        return MiniSpecReturnValue(cmp, False)
 
     def __repr__(self) -> str:
         s = ''
@@ -400,24 +657,49 @@ class Statement:
             s += '}'
         return s
 
+class CompiledStatement:
+    """A top-level statement of a plan that was validated and optimized in full, see MiniSpecInterpreter.prepare()."""
+    def __init__(self, context: ExecutionContext, env: dict, node: Node) -> None:
+        self.context = context
+        self.env = env
+        self.node = node
+        # the statement itself is timed in eval(), the ones in its blocks by their evaluators
+        self.evaluator = compile_node(node, timed=True)
+        self.kind = statement_kind(node)
+        self.ret = False
+
+    def eval(self) -> MiniSpecReturnValue:
+        with self.context.metrics.time('statement', self.kind):
+            ret_val = self.evaluator(self.context, self.env)
+        # as Statement: a replan inside a block ends the plan
+        self.ret = ret_val.ret or (self.kind != 'expr' and ret_val.replan)
+        return ret_val
+
+    def __repr__(self) -> str:
+        return repr(self.node)
+
 class MiniSpecInterpreter:
-    def __init__(self, message_queue: queue.Queue):
+    def __init__(self, context: ExecutionContext, message_queue: queue.Queue):
         self.env = {}
         self.ret = False
         self.code_buffer: str = ''
         self.execution_history = []
-        if Statement.low_level_skillset is None or \
-            Statement.high_level_skillset is None:
-            raise Exception('Statement: Skillset is not initialized')
-        
-        Statement.execution_queue = Queue()
+        if context.low_level_skillset is None or \
+            context.high_level_skillset is None:
+            raise Exception('ExecutionContext: Skillset is not initialized')
+
+        # statements are queued as soon as they are parsed, `None` marks the end of the program
+        self.context = context.for_execution()
+        self.execution_queue: Queue[Optional[Statement | CompiledStatement]] = self.context.execution_queue
         self.execution_thread = Thread(target=self.executor)
         self.execution_thread.start()
 
         self.timestamp_get_plan = None
+        self.timestamp_first_action = None
         self.timestamp_start_execution = None
         self.timestamp_end_execution = None
-        self.program_count = 0
+        # set when a complete plan fails validation, nothing is executed then
+        self.plan_error: Optional[MiniSpecReturnValue] = None
         self.ret_queue = Queue()
         self.message_queue = message_queue
 
@@ -425,38 +707,67 @@ class MiniSpecInterpreter:
         print_t(f'>>> Get a stream')
         self.execution_history = []
         self.timestamp_get_plan = time.time()
-        program = MiniSpecProgram(mq=self.message_queue)
-        program.parse(code, True)
-        self.program_count = len(program.statements)
+        if isinstance(code, (str, list)):
+            statements = self.prepare(''.join(code))
+            if self.message_queue and len(statements) > 0:
+                self.message_queue.put('; '.join(repr(statement) for statement in statements) + '\\\\')
+            for statement in statements:
+                self.execution_queue.put(statement)
+            self.execution_queue.put(None)
+            print_t(">>> Program: ", statements, "Time: ", time.time() - self.timestamp_get_plan)
+            return
+        program = MiniSpecProgram(self.context, mq=self.message_queue)
+        try:
+            program.parse(code, True)
+        except BaseException:
+            # blocks that will never be closed must not keep the executor waiting
+            program.abort()
+            raise
+        finally:
+            self.execution_queue.put(None)
         t2 = time.time()
         print_t(">>> Program: ", program, "Time: ", t2 - self.timestamp_get_plan)
 
+    def prepare(self, code: str) -> List[CompiledStatement]:
+        """
+        Validates and optimizes a plan that is available in full, before any of it runs.
+        The optimized tree is compiled as it is, the code is not parsed a second time.
+        """
+        try:
+            program = validate(parse_program(code), self.context.low_level_skillset, self.context.high_level_skillset)
+            program = optimize(program)
+        except Exception as e:
+            print_t(f'>>> Invalid plan: {e}')
+            self.plan_error = MiniSpecReturnValue(f'Invalid plan: {e}', True)
+            return []
+        env = {}
+        return [CompiledStatement(self.context, env, statement) for statement in program.statements]
+
     def executor(self):
+        ret_val = MiniSpecReturnValue.default()
         while True:
-            if not Statement.execution_queue.empty():
-                if self.timestamp_start_execution is None:
-                    self.timestamp_start_execution = time.time()
-                    print_t(">>> Start execution")
-                statement = Statement.execution_queue.get()
-                print_debug(f'Queue get statement: {statement}')
-                ret_val = statement.eval()
-                print_t(f'Queue statement done: {statement}')
-                if statement.ret:
-                    while not Statement.execution_queue.empty():
-                        Statement.execution_queue.get()
-                    self.ret_queue.put(ret_val)
-                    return
-                self.execution_history.append(statement)
-                # if ret_val.replan:
-                #     print_t(f'Queue statement replan: {statement}')
-                #     self.ret_queue.put(ret_val)
-                #     return
-                self.program_count -= 1
-                if self.program_count == 0:
-                    self.timestamp_end_execution = time.time()
+            statement = self.execution_queue.get()
+            if statement is None:
+                self.timestamp_end_execution = time.time()
+                if self.timestamp_start_execution is not None:
                     print_t(f'>>> Execution time: {self.timestamp_end_execution - self.timestamp_start_execution}')
-                    self.timestamp_start_execution = None
-                    self.ret_queue.put(ret_val)
-                    return
-            else:
-                time.sleep(0.005)
+                self.timestamp_start_execution = None
+                self.ret_queue.put(self.plan_error if self.plan_error is not None else ret_val)
+                return
+            if self.timestamp_start_execution is None:
+                self.timestamp_start_execution = time.time()
+                if self.timestamp_first_action is None:
+                    self.timestamp_first_action = self.timestamp_start_execution
+                print_t(">>> Start execution")
+            print_debug(f'Queue get statement: {statement}')
+            try:
+                ret_val = statement.eval()
+            except Exception as e:
+                print_t(f'Queue statement error: {statement} {e}')
+                self.ret_queue.put(MiniSpecReturnValue(f'{statement}: {e}', True))
+                return
+            print_t(f'Queue statement done: {statement}')
+            if statement.ret:
+                self.ret_queue.put(ret_val)
+                return
+            self.execution_history.append(statement)
@@ -0,0 +1,224 @@
+from typing import List, Optional
+from .abs.skill_item import SkillItem, SkillArg
+from .skillset import SkillSet
+from .minispec_parser import Node, Literal, Variable, Call, BinaryOp, Compare, BoolOp, Assign, Return, Program, If, Loop, \
+    BUILTIN_FUNCTIONS, transform, walk
+
+'''
+Static checks and rewrites applied to a complete MiniSpec plan before any of it
+runs, so mistakes are reported before the robot moves.
+'''
+
+# motion skill -> (axis, direction)
+MOTION_AXES = {
+    'move_forward': ('x', 1),
+    'move_backward': ('x', -1),
+    'move_left': ('y', 1),
+    'move_right': ('y', -1),
+    'move_up': ('z', 1),
+    'move_down': ('z', -1),
+    'turn_ccw': ('yaw', 1),
+    'turn_cw': ('yaw', -1),
+}
+# only merge motions when the result is still a valid single command
+MOTION_LIMITS = {
+    'x': (20, 300),
+    'y': (20, 300),
+    'z': (20, 300),
+    'yaw': (1, 360),
+}
+
+def resolve_skill(name: str, low_level_skillset: SkillSet, high_level_skillset: SkillSet) -> Optional[SkillItem]:
+    skill = low_level_skillset.get_skill(name)
+    if skill is None:
+        skill = high_level_skillset.get_skill(name)
+    return skill
+
+def check_literal_argument(skill_name: str, arg: SkillArg, value) -> None:
+    if value is None or arg.arg_type == str:
+        return
+    if isinstance(value, str):
+        if arg.arg_type == bool:
+            if value.strip().lower() not in ('true', 'false'):
+                raise ValueError(f"Skill '{skill_name}' expects {arg}, but got '{value}'.")
+            return
+        try:
+            arg.arg_type(value.strip())
+        except ValueError:
+            raise ValueError(f"Skill '{skill_name}' expects {arg}, but got '{value}'.")
+        return
+    if arg.arg_type == bool and not isinstance(value, bool) or \
+        arg.arg_type in (int, float) and isinstance(value, bool) or \
+        arg.arg_type == int and isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Skill '{skill_name}' expects {arg}, but got {value}.")
+
+def check_call(node: Call, low_level_skillset: SkillSet, high_level_skillset: SkillSet) -> Call:
+    """The call with the skill name resolved and numeric literal arguments converted, raises ValueError if invalid."""
+    if node.name in BUILTIN_FUNCTIONS:
+        if len(node.args) != 1:
+            raise ValueError(f"Function '{node.name}' expects 1 argument, but got {len(node.args)}.")
+        return node
+    skill = resolve_skill(node.name, low_level_skillset, high_level_skillset)
+    if skill is None:
+        raise ValueError(f"Skill '{node.name}' is not defined.")
+    args = skill.get_argument()
+    if len(node.args) != len(args):
+        raise ValueError(f"Skill '{skill.get_name()}' expects {len(args)} arguments, but got {len(node.args)}.")
+    call_args = []
+    for arg, value in zip(args, node.args):
+        if isinstance(value, Literal):
+            check_literal_argument(skill.get_name(), arg, value.value)
+            # e.g. move_forward(50.0) -> move_forward(50)
+            if arg.arg_type in (int, float) and type(value.value) in (int, float):
+                value = Literal(arg.arg_type(value.value))
+        call_args.append(value)
+    return Call(skill.get_name(), call_args)
+
+def validate(program: Node, low_level_skillset: SkillSet, high_level_skillset: SkillSet) -> Node:
+    """
+    Resolves skill names and abbreviations to full skill names, checks the number of
+    arguments and the type of literal arguments, and rejects variables that are never
+    assigned. Raises ValueError on the first problem.
+    """
+    assigned = set(node.name for node in walk(program) if isinstance(node, Assign))
+
+    def check(node: Node) -> Node:
+        if isinstance(node, Variable) and node.name not in assigned:
+            raise ValueError(f"Variable {node.name} is never assigned.")
+        if isinstance(node, Call):
+            return check_call(node, low_level_skillset, high_level_skillset)
+        return node
+
+    return transform(program, check)
+
+def check_statement(statement: Node, low_level_skillset: SkillSet, high_level_skillset: SkillSet, assigned: set):
+    """
+    What validate() checks, for one statement of a plan that is still streaming in,
+    without rewriting it. `assigned` are the variables assigned so far, including the
+    ones the statement assigns.
+    """
+    for node in walk(statement):
+        if isinstance(node, Variable) and node.name not in assigned:
+            raise ValueError(f"Variable {node.name} is never assigned.")
+        if isinstance(node, Call):
+            check_call(node, low_level_skillset, high_level_skillset)
+
+def is_number(node: Node) -> bool:
+    return isinstance(node, Literal) and type(node.value) in (int, float)
+
+def fold_constant(node: Node) -> Node:
+    if isinstance(node, BinaryOp) and is_number(node.left) and is_number(node.right):
+        a, b = node.left.value, node.right.value
+        if node.op == '+':
+            return Literal(a + b)
+        if node.op == '-':
+            return Literal(a - b)
+        if node.op == '*':
+            return Literal(a * b)
+        if node.op == '/' and b != 0:
+            return Literal(a / b)
+        return node
+
+    if isinstance(node, Compare) and isinstance(node.left, Literal) and isinstance(node.right, Literal):
+        a, b = node.left.value, node.right.value
+        if node.op == '==':
+            return Literal(a == b if is_number(node.left) == is_number(node.right) else False)
+        if node.op == '!=':
+            return Literal(a != b if is_number(node.left) == is_number(node.right) else True)
+        if is_number(node.left) and is_number(node.right):
+            return Literal(a > b if node.op == '>' else a < b)
+        return node
+
+    if isinstance(node, BoolOp):
+        # drop operands that cannot decide the result, stop at one that does
+        decided_by = node.op == '|'
+        operands = []
+        for operand in node.operands:
+            if isinstance(operand, Literal):
+                if bool(operand.value) == decided_by:
+                    if len(operands) == 0:
+                        return Literal(decided_by)
+                    operands.append(operand)
+                    break
+                continue
+            operands.append(operand)
+        if len(operands) == 0:
+            return Literal(not decided_by)
+        return operands[0] if len(operands) == 1 and not isinstance(operands[0], Literal) else BoolOp(node.op, operands)
+
+    if isinstance(node, Call) and node.name in BUILTIN_FUNCTIONS and len(node.args) == 1 \
+        and isinstance(node.args[0], Literal):
+        try:
+            return Literal(BUILTIN_FUNCTIONS[node.name](node.args[0].value))
+        except (TypeError, ValueError):
+            return node
+
+    if isinstance(node, If) and isinstance(node.condition, Literal):
+        if not node.condition.value:
+            return Program([])
+        # a replan or return inside a block ends the plan, spliced into the parent it would not
+        if can_end_plan(node.body):
+            return node
+        # the parent program splices the body in
+        return node.body
+
+    if isinstance(node, Loop) and (node.count == 0 or len(node.body.statements) == 0):
+        return Program([])
+
+    if isinstance(node, Program):
+        return Program(coalesce_motions(flatten(node.statements)))
+
+    return node
+
+def can_end_plan(node: Node) -> bool:
+    """True if the node returns or calls a skill, any skill may ask for a replan."""
+    return any(isinstance(child, Return) or isinstance(child, Call) and child.name not in BUILTIN_FUNCTIONS
+               for child in walk(node))
+
+def flatten(statements: List[Node]) -> List[Node]:
+    result = []
+    for statement in statements:
+        if isinstance(statement, Program):
+            result.extend(statement.statements)
+        else:
+            result.append(statement)
+    return result
+
+def as_motion(node: Node) -> Optional[tuple]:
+    if isinstance(node, Call) and node.name in MOTION_AXES and len(node.args) == 1 \
+        and isinstance(node.args[0], Literal) and type(node.args[0].value) == int:
+        axis, direction = MOTION_AXES[node.name]
+        return axis, direction * node.args[0].value
+    return None
+
+def merge_motions(axis: str, amount: int) -> Optional[List[Node]]:
+    """Returns the statements replacing two motions on one axis, or None if they can't be merged."""
+    if amount == 0:
+        return []
+    low, high = MOTION_LIMITS[axis]
+    if not low <= abs(amount) <= high:
+        return None
+    direction = 1 if amount > 0 else -1
+    for name, (motion_axis, motion_direction) in MOTION_AXES.items():
+        if motion_axis == axis and motion_direction == direction:
+            return [Call(name, [Literal(abs(amount))])]
+    return None
+
+def coalesce_motions(statements: List[Node]) -> List[Node]:
+    """Merges adjacent motions on the same axis, e.g. mf(50);mf(50) -> move_forward(100), tc(30);tu(30) -> nothing."""
+    result = []
+    for statement in statements:
+        current = as_motion(statement)
+        previous = as_motion(result[-1]) if len(result) > 0 else None
+        if current is not None and previous is not None and current[0] == previous[0]:
+            merged = merge_motions(current[0], previous[1] + current[1])
+            if merged is not None:
+                result.pop()
+                result.extend(merged)
+                continue
+        result.append(statement)
+    return result
+
+def optimize(program: Node) -> Node:
+    """Folds constant expressions and coalesces adjacent motions. Expects skill names resolved by validate()."""
+    return transform(program, fold_constant)
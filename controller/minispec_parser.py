@@ -0,0 +1,352 @@
+import re, copy
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+'''
+Tokenizer and recursive-descent parser for MiniSpec. The parser only builds the
+typed AST below; turning it into executable closures is done by the interpreter.
+'''
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<SPACE>\s+)
+  | (?P<NUMBER>\d+\.\d*|\.\d+|\d+)
+  | (?P<STRING>'[^']*'|"[^"]*")
+  | (?P<PARAM>\$\d+)
+  | (?P<NAME>[A-Za-z_]\w*)
+  | (?P<OP>->|==|!=|[-+*/<>=&|?;{}(),])
+''', re.VERBOSE)
+
+COMPARATORS = ('>', '<', '==', '!=')
+KEYWORDS = {'True': True, 'False': False, 'None': None}
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+BUILTIN_FUNCTIONS = {
+    'int': int,
+    'float': float,
+    'str': str,
+}
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    pos: int
+
+def tokenize(code: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(code):
+        match = TOKEN_REGEX.match(code, pos)
+        if match is None:
+            raise Exception(f'Invalid character {code[pos]!r} at {pos} in: {code}')
+        if match.lastgroup != 'SPACE':
+            tokens.append(Token(match.lastgroup, match.group(), pos))
+        pos = match.end()
+    tokens.append(Token('EOF', '', pos))
+    return tokens
+
+class Node:
+    pass
+
+class Literal(Node):
+    def __init__(self, value: Union[int, float, bool, str, None]):
+        self.value = value
+
+    def __repr__(self) -> str:
+        # reprs round-trip through the parser, which has no exponent notation
+        if isinstance(self.value, float) and 'e' in repr(self.value):
+            return f'{self.value:.20f}'.rstrip('0')
+        return repr(self.value)
+
+class Variable(Node):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return self.name
+
+class Parameter(Node):
+    """Positional argument `$n` of a high-level skill definition."""
+    def __init__(self, index: int):
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f'${self.index}'
+
+class Call(Node):
+    def __init__(self, name: str, args: List[Node]):
+        self.name = name
+        self.args = args
+
+    def __repr__(self) -> str:
+        return f'{self.name}({",".join(repr(arg) for arg in self.args)})'
+
+class BinaryOp(Node):
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __repr__(self) -> str:
+        left, right = repr(self.left), repr(self.right)
+        if isinstance(self.left, BinaryOp) and PRECEDENCE[self.left.op] < PRECEDENCE[self.op]:
+            left = f'({left})'
+        if isinstance(self.right, BinaryOp) and PRECEDENCE[self.right.op] <= PRECEDENCE[self.op] or \
+            isinstance(self.right, Literal) and right.startswith('-'):
+            right = f'({right})'
+        return f'{left}{self.op}{right}'
+
+class Compare(Node):
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __repr__(self) -> str:
+        return f'{self.left}{self.op}{self.right}'
+
+class BoolOp(Node):
+    def __init__(self, op: str, operands: List[Node]):
+        self.op = op
+        self.operands = operands
+
+    def __repr__(self) -> str:
+        return self.op.join(repr(operand) for operand in self.operands)
+
+class Assign(Node):
+    def __init__(self, name: str, value: Node):
+        self.name = name
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f'{self.name}={self.value}'
+
+class Return(Node):
+    def __init__(self, value: Node):
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f'->{self.value}'
+
+class Program(Node):
+    def __init__(self, statements: List[Node]):
+        self.statements = statements
+
+    def __repr__(self) -> str:
+        return ''.join(f'{statement};' for statement in self.statements)
+
+class If(Node):
+    def __init__(self, condition: Node, body: Program):
+        self.condition = condition
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f'?{self.condition}{{{self.body}}}'
+
+class Loop(Node):
+    def __init__(self, count: int, body: Program):
+        self.count = count
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f'{self.count}{{{self.body}}}'
+
+class Parser:
+    def __init__(self, code: str):
+        self.code = code
+        self.tokens = tokenize(code)
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Token:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def advance(self) -> Token:
+        token = self.tokens[self.pos]
+        if token.kind != 'EOF':
+            self.pos += 1
+        return token
+
+    def accept(self, value: str) -> bool:
+        if self.peek().kind == 'OP' and self.peek().value == value:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value: str) -> Token:
+        token = self.advance()
+        if token.kind != 'OP' or token.value != value:
+            raise Exception(f'Expected {value!r} at {token.pos} but got {token.value!r} in: {self.code}')
+        return token
+
+    def expect_end(self):
+        token = self.peek()
+        if token.kind != 'EOF':
+            raise Exception(f'Unexpected {token.value!r} at {token.pos} in: {self.code}')
+
+    def parse_program(self) -> Program:
+        """program ::= { statement [';'] }, ending at '}' or the end of input."""
+        statements = []
+        while True:
+            while self.accept(';'):
+                pass
+            token = self.peek()
+            if token.kind == 'EOF' or (token.kind == 'OP' and token.value == '}'):
+                return Program(statements)
+            statements.append(self.parse_statement())
+
+    def parse_block(self) -> Program:
+        self.expect('{')
+        body = self.parse_program()
+        self.expect('}')
+        return body
+
+    def parse_statement(self) -> Node:
+        token = self.peek()
+        if token.kind == 'OP' and token.value == '?':
+            self.advance()
+            condition = self.parse_condition()
+            return If(condition, self.parse_block())
+        if token.kind == 'NUMBER' and token.value.isdigit() and self.peek(1).value == '{':
+            self.advance()
+            return Loop(int(token.value), self.parse_block())
+        if token.kind == 'OP' and token.value == '->':
+            self.advance()
+            if self.peek().kind == 'EOF' or self.peek().value in (';', '}'):
+                return Return(Literal(None))
+            return Return(self.parse_expression())
+        if token.kind == 'NAME' and token.value.startswith('_') and self.peek(1).value == '=':
+            self.advance()
+            self.advance()
+            return Assign(token.value, self.parse_expression())
+        return self.parse_expression()
+
+    def parse_condition(self) -> Node:
+        # '&' binds looser than '|' in MiniSpec: a&b|c is a&(b|c)
+        operands = [self.parse_or_condition()]
+        while self.accept('&'):
+            operands.append(self.parse_or_condition())
+        return operands[0] if len(operands) == 1 else BoolOp('&', operands)
+
+    def parse_or_condition(self) -> Node:
+        operands = [self.parse_comparison()]
+        while self.accept('|'):
+            operands.append(self.parse_comparison())
+        return operands[0] if len(operands) == 1 else BoolOp('|', operands)
+
+    def parse_comparison(self) -> Node:
+        left = self.parse_expression()
+        token = self.peek()
+        if token.kind == 'OP' and token.value in COMPARATORS:
+            self.advance()
+            return Compare(token.value, left, self.parse_expression())
+        return left
+
+    def parse_expression(self) -> Node:
+        node = self.parse_term()
+        while self.peek().kind == 'OP' and self.peek().value in ('+', '-'):
+            op = self.advance().value
+            node = BinaryOp(op, node, self.parse_term())
+        return node
+
+    def parse_term(self) -> Node:
+        node = self.parse_unary()
+        while self.peek().kind == 'OP' and self.peek().value in ('*', '/'):
+            op = self.advance().value
+            node = BinaryOp(op, node, self.parse_unary())
+        return node
+
+    def parse_unary(self) -> Node:
+        if self.accept('-'):
+            operand = self.parse_unary()
+            if isinstance(operand, Literal) and isinstance(operand.value, (int, float)):
+                return Literal(-operand.value)
+            return BinaryOp('-', Literal(0), operand)
+        return self.parse_primary()
+
+    def parse_primary(self, in_argument: bool = False) -> Node:
+        token = self.advance()
+        if token.kind == 'NUMBER':
+            return Literal(int(token.value) if token.value.isdigit() else float(token.value))
+        if token.kind == 'STRING':
+            return Literal(token.value[1:-1])
+        if token.kind == 'PARAM':
+            return Parameter(int(token.value[1:]))
+        if token.kind == 'NAME':
+            if token.value in KEYWORDS:
+                return Literal(KEYWORDS[token.value])
+            if token.value.startswith('_'):
+                return Variable(token.value)
+            if self.accept('('):
+                return Call(token.value, self.parse_arguments())
+            if in_argument:
+                # bare words are string arguments, e.g. iv(sports ball)
+                words = [token.value]
+                while self.peek().kind == 'NAME':
+                    words.append(self.advance().value)
+                return Literal(' '.join(words))
+            return Call(token.value, [])
+        if token.kind == 'OP' and token.value == '(':
+            node = self.parse_expression()
+            self.expect(')')
+            return node
+        raise Exception(f'Unexpected {token.value!r} at {token.pos} in: {self.code}')
+
+    def parse_arguments(self) -> List[Node]:
+        args = []
+        if self.accept(')'):
+            return args
+        while True:
+            args.append(self.parse_argument())
+            if self.accept(')'):
+                return args
+            self.expect(',')
+
+    def parse_argument(self) -> Node:
+        token = self.peek()
+        if token.kind == 'NAME' and token.value not in KEYWORDS and not token.value.startswith('_') \
+            and self.peek(1).value != '(':
+            return self.parse_primary(in_argument=True)
+        return self.parse_expression()
+
+def transform(node: Node, fn: Callable[[Node], Node]) -> Node:
+    """Rebuilds the tree bottom-up, replacing every node with fn(node). The input is not modified."""
+    node = copy.copy(node)
+    for key, value in vars(node).items():
+        if isinstance(value, Node):
+            setattr(node, key, transform(value, fn))
+        elif isinstance(value, list):
+            setattr(node, key, [transform(item, fn) if isinstance(item, Node) else item for item in value])
+    return fn(node)
+
+def walk(node: Node) -> Iterator[Node]:
+    yield node
+    for value in vars(node).values():
+        if isinstance(value, Node):
+            yield from walk(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, Node):
+                    yield from walk(item)
+
+def bind_parameters(node: Node, args: Sequence[Union[int, float, bool, str, None]]) -> Node:
+    """Substitutes `$n` with the n-th argument."""
+    return transform(node, lambda n: Literal(args[n.index - 1]) if isinstance(n, Parameter) else n)
+
+def parse_program(code: str) -> Program:
+    parser = Parser(code)
+    program = parser.parse_program()
+    parser.expect_end()
+    return program
+
+def parse_statement(code: str) -> Optional[Node]:
+    parser = Parser(code)
+    program = parser.parse_program()
+    parser.expect_end()
+    if len(program.statements) == 0:
+        return None
+    if len(program.statements) > 1:
+        raise Exception(f'Expected a single statement in: {code}')
+    return program.statements[0]
+
+def parse_condition(code: str) -> Node:
+    parser = Parser(code)
+    condition = parser.parse_condition()
+    parser.expect_end()
+    return condition
@@ -0,0 +1,149 @@
+from typing import List, Optional, Tuple
+from numpy.typing import NDArray
+import numpy as np
+import time
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+'''
+Multi-object tracker with one constant-velocity Kalman filter per track. All
+tracks live in contiguous arrays, so predicting and updating N tracks is a few
+batched matrix operations instead of N filter objects.
+
+State per track: [cx, cy, w, h, vcx, vcy, vw, vh] in normalized image coordinates.
+'''
+
+DIM_X = 8
+DIM_Z = 4
+
+# constant velocity, one step per detection frame
+F = np.eye(DIM_X)
+F[:DIM_Z, DIM_Z:] = np.eye(DIM_Z)
+H = np.eye(DIM_Z, DIM_X)
+Q = np.eye(DIM_X) * 0.01  # process uncertainty
+R = np.eye(DIM_Z)  # measurement uncertainty
+P0 = np.eye(DIM_X) * 1000  # initial uncertainty
+
+def xyxy_to_cxcywh(boxes: NDArray) -> NDArray:
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                     boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+
+def cxcywh_to_xyxy(boxes: NDArray) -> NDArray:
+    return np.stack([boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2,
+                     boxes[:, 0] + boxes[:, 2] / 2, boxes[:, 1] + boxes[:, 3] / 2], axis=1)
+
+def iou_matrix(a: NDArray, b: NDArray) -> NDArray:
+    """IoU of every pair of xyxy boxes, shape (len(a), len(b))."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def distance_matrix(a: NDArray, b: NDArray) -> NDArray:
+    """Centre distance of every pair of cxcywh boxes."""
+    return np.linalg.norm(a[:, None, :2] - b[None, :, :2], axis=2)
+
+def greedy_assignment(cost: NDArray) -> Tuple[NDArray, NDArray]:
+    """Picks the cheapest remaining pair until rows or columns run out."""
+    rows, cols = [], []
+    used_rows, used_cols = set(), set()
+    for index in np.argsort(cost, axis=None):
+        row, col = divmod(int(index), cost.shape[1])
+        if row in used_rows or col in used_cols:
+            continue
+        rows.append(row)
+        cols.append(col)
+        used_rows.add(row)
+        used_cols.add(col)
+        if len(used_rows) == cost.shape[0] or len(used_cols) == cost.shape[1]:
+            break
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+class MultiObjectTracker:
+    def __init__(self, metric: str = 'distance', max_cost: Optional[float] = None, max_age: float = 0.5):
+        if metric not in ('distance', 'iou'):
+            raise ValueError(f"Unknown association metric: {metric}")
+        self.metric = metric
+        # pairs costing more are never associated: centre distance, or 1 - IoU
+        if max_cost is None:
+            max_cost = 0.15 if metric == 'distance' else 0.9
+        self.max_cost = max_cost
+        # tracks without a matching detection for this long are dropped
+        self.max_age = max_age
+        self.x = np.zeros((0, DIM_X))
+        self.P = np.zeros((0, DIM_X, DIM_X))
+        self.names = np.zeros(0, dtype=object)
+        self.last_seen = np.zeros(0)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def predict(self):
+        self.x = self.x @ F.T
+        self.P = F @ self.P @ F.T + Q
+
+    def associate(self, names: NDArray, boxes: NDArray) -> Tuple[NDArray, NDArray]:
+        """Returns matching (track, detection) index arrays, only between objects of the same name."""
+        if len(self) == 0 or len(names) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        if self.metric == 'distance':
+            cost = distance_matrix(self.x[:, :DIM_Z], boxes)
+        else:
+            cost = 1 - iou_matrix(cxcywh_to_xyxy(self.x[:, :DIM_Z]), cxcywh_to_xyxy(boxes))
+        invalid = (self.names[:, None] != names[None, :]) | (cost > self.max_cost)
+        # larger than any valid cost, so the solver only uses these pairs when it must
+        cost = np.where(invalid, self.max_cost + 1, cost)
+        if linear_sum_assignment is not None:
+            rows, cols = linear_sum_assignment(cost)
+        else:
+            rows, cols = greedy_assignment(cost)
+        valid = ~invalid[rows, cols]
+        return rows[valid], cols[valid]
+
+    def update(self, names: List[str], boxes: NDArray, timestamp: Optional[float] = None):
+        """Feeds one frame of detections, `boxes` is (M, 4) in normalized xyxy."""
+        if timestamp is None:
+            timestamp = time.time()
+        names = np.array(names, dtype=object)
+        boxes = xyxy_to_cxcywh(np.asarray(boxes, dtype=float).reshape(-1, 4))
+
+        self.predict()
+        tracks, detections = self.associate(names, boxes)
+
+        if len(tracks) > 0:
+            P = self.P[tracks]
+            residual = boxes[detections] - self.x[tracks, :DIM_Z]
+            S = H @ P @ H.T + R
+            # K = P H^T S^-1, S is symmetric
+            K = np.linalg.solve(S, (P @ H.T).transpose(0, 2, 1)).transpose(0, 2, 1)
+            self.x[tracks] += (K @ residual[:, :, None])[:, :, 0]
+            self.P[tracks] = (np.eye(DIM_X) - K @ H) @ P
+            self.last_seen[tracks] = timestamp
+
+        new = np.ones(len(names), dtype=bool)
+        new[detections] = False
+        count = int(new.sum())
+        if count > 0:
+            x = np.zeros((count, DIM_X))
+            x[:, :DIM_Z] = boxes[new]
+            self.x = np.concatenate([self.x, x])
+            self.P = np.concatenate([self.P, np.repeat(P0[None], count, axis=0)])
+            self.names = np.concatenate([self.names, names[new]])
+            self.last_seen = np.concatenate([self.last_seen, np.full(count, timestamp)])
+
+        alive = timestamp - self.last_seen <= self.max_age
+        if not alive.all():
+            self.x, self.P = self.x[alive], self.P[alive]
+            self.names, self.last_seen = self.names[alive], self.last_seen[alive]
+
+    def objects(self) -> Tuple[List[str], NDArray]:
+        """Names and (N, 4) cxcywh estimates of the live tracks."""
+        return self.names.tolist(), self.x[:, :DIM_Z].copy()
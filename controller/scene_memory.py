@@ -0,0 +1,71 @@
+from collections import deque
+from typing import Dict, List, Optional
+import threading
+import time
+
+from .detection_store import Detections, ObjectInfo
+
+'''
+Short-term memory of the recent detection frames, so an object missing from a
+single YOLO frame is still answered for immediately instead of being waited for.
+'''
+
+class SceneMemory:
+    def __init__(self, ttl: float = 2.0, capacity: int = 64):
+        # frames older than ttl seconds are dropped
+        self.ttl = ttl
+        self.frames: deque[Detections] = deque(maxlen=capacity)
+        # frames before this time no longer describe the scene, e.g. the robot moved since
+        self.forgotten = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, detections: Detections):
+        with self.lock:
+            self.frames.append(detections)
+            while self.frames[0].timestamp < detections.timestamp - self.ttl:
+                self.frames.popleft()
+
+    def forget(self, timestamp: Optional[float] = None):
+        with self.lock:
+            self.forgotten = time.time() if timestamp is None else timestamp
+
+    def recent(self, within: float) -> List[Detections]:
+        """Frames of the last `within` seconds, newest first."""
+        since = max(time.time() - within, self.forgotten)
+        with self.lock:
+            frames = list(self.frames)
+        result = []
+        for detections in reversed(frames):
+            if detections.timestamp < since:
+                break
+            result.append(detections)
+        return result
+
+    def recall(self, object_name: str, within: float) -> Optional[ObjectInfo]:
+        """The latest sighting of the object in the last `within` seconds."""
+        for detections in self.recent(within):
+            info = detections.get(object_name)
+            if info is not None:
+                return info
+        return None
+
+    def stable_objects(self, within: float, min_ratio: float = 0.5) -> List[ObjectInfo]:
+        """
+        Objects seen in at least `min_ratio` of the frames of the last `within`
+        seconds, at their latest position. One-frame false positives are left out.
+        """
+        frames = self.recent(within)
+        if len(frames) == 0:
+            return []
+        counts: Dict[str, int] = {}
+        for detections in frames:
+            for name in set(detections.names):
+                counts[name] = counts.get(name, 0) + 1
+        objects, reported = [], set()
+        for detections in frames:
+            for row, name in enumerate(detections.names):
+                if counts[name] >= min_ratio * len(frames) and name not in reported:
+                    objects.append(detections.object(row))
+            # every instance of a name is taken from the newest frame containing it
+            reported.update(detections.names)
+        return objects
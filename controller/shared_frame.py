@@ -1,70 +1,151 @@
 from PIL import Image
-from typing import Optional
+from typing import Any, List, NamedTuple, Optional
 from numpy.typing import NDArray
 import numpy as np
 import threading
 import time
+from .detection_store import Detections
+from .scene_memory import SceneMemory
+
+def read_only(array: Optional[NDArray]) -> Optional[NDArray]:
+    """A read-only view of the array, the caller's array itself is left writable."""
+    if array is None:
+        return None
+    view = array.view()
+    view.flags.writeable = False
+    return view
 
 class Frame():
-    def __init__(self, image: Image.Image | NDArray[np.uint8]=None, depth: Optional[NDArray[np.int16]]=None):
+    """
+    An immutable image with optional depth, safe to share across threads. Only the
+    form it was created from is stored; the other one (PIL or numpy) is created once,
+    on first use. A numpy image is kept as a read-only view, so the caller must not
+    modify it afterwards.
+    """
+    def __init__(self, image: Image.Image | NDArray[np.uint8]=None, depth: Optional[NDArray[np.int16]]=None,
+                 timestamp: Optional[float] = None):
+        # capture time
+        self.timestamp = time.time() if timestamp is None else timestamp
         if image is None:
-            self._image_buffer = np.zeros((352, 640, 3), dtype=np.uint8)
-            self._image = Image.fromarray(self._image_buffer)
+            image = np.zeros((352, 640, 3), dtype=np.uint8)
+        self._image: Optional[Image.Image] = None
+        self._image_buffer: Optional[NDArray[np.uint8]] = None
         if isinstance(image, np.ndarray):
-            self._image_buffer = image
-            self._image = Image.fromarray(image)
+            self._image_buffer = read_only(image)
         elif isinstance(image, Image.Image):
             self._image = image
-            self._image_buffer = np.array(image)
-        self._depth = depth
-    
+        else:
+            raise ValueError(f"Unsupported image type: {type(image)}")
+        self._depth = read_only(depth)
+
     @property
     def image(self) -> Image.Image:
+        """Read-only, copy it before drawing on it."""
+        if self._image is None:
+            # maps the buffer where PIL can (L, RGBA), RGB is converted since PIL pads it to 32 bits
+            self._image = Image.fromarray(self._image_buffer)
         return self._image
-    
+
+    @property
+    def image_buffer(self) -> NDArray[np.uint8]:
+        """Read-only HxWxC array."""
+        if self._image_buffer is None:
+            # PIL has no zero-copy export
+            self._image_buffer = read_only(np.asarray(self._image))
+        return self._image_buffer
+
     @property
     def depth(self) -> Optional[NDArray[np.int16]]:
         return self._depth
-    
-    @image.setter
-    def image(self, image: Image.Image):
-        self._image = image
-        self._image_buffer = np.array(image)
 
-    @depth.setter
-    def depth(self, depth: Optional[NDArray[np.int16]]):
-        self._depth = depth
+class FrameEntry(NamedTuple):
+    seq: int
+    frame: Frame
+    # as received: the JSON dict, or the DetectionBatch message of the gRPC client
+    yolo_result: Any
+    detections: Detections
+    # when the frame was captured and when its detection result arrived
+    capture_ts: float
+    result_ts: float
+
+class SharedFrame():
+    """
+    Fixed-capacity ring of the latest frames with their detection results. Every
+    entry gets a monotonic sequence number. Readers never take the writer's lock:
+    a slot is filled before the sequence number that points at it is published.
+    """
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        empty = FrameEntry(0, Frame(), {}, Detections.empty(), 0, 0)
+        self.entries: List[FrameEntry] = [empty] * capacity
+        self.seq = 0
+        self.write_lock = threading.Lock()
+        # notified on every set(), see wait_for()
+        self.updated = threading.Condition()
+        self.scene_memory = SceneMemory()
 
     @property
-    def image_buffer(self) -> NDArray[np.uint8]:
-        return self._image_buffer
-    
-    @image_buffer.setter
-    def image_buffer(self, image_buffer: NDArray[np.uint8]):
-        self._image_buffer = image_buffer
-        self._image = Image.fromarray(image_buffer)
+    def timestamp(self) -> float:
+        return self.latest().result_ts
 
-class SharedFrame():
-    def __init__(self):
-        self.timestamp = 0
-        self.frame = Frame()
-        self.yolo_result = {}
-        self.lock = threading.Lock()
+    def latest(self) -> FrameEntry:
+        return self.entries[self.seq % self.capacity]
+
+    def get(self, seq: int) -> Optional[FrameEntry]:
+        """The entry with this sequence number, None if it was overwritten or not set yet."""
+        entry = self.entries[seq % self.capacity]
+        return entry if entry.seq == seq else None
+
+    def since(self, seq: int) -> List[FrameEntry]:
+        """Entries newer than `seq` still in the ring, oldest first, for consumers that must not skip frames."""
+        latest = self.seq
+        entries = [self.get(n) for n in range(max(seq + 1, latest - self.capacity + 1), latest + 1)]
+        return [entry for entry in entries if entry is not None]
+
+    def wait_for(self, seq: int, timeout: Optional[float] = None) -> Optional[FrameEntry]:
+        """Blocks until an entry newer than `seq` is set and returns the latest one, None on timeout."""
+        with self.updated:
+            if not self.updated.wait_for(lambda: self.seq > seq, timeout):
+                return None
+        return self.latest()
 
     def get_image(self) -> Optional[Image.Image]:
-        with self.lock:
-            return self.frame.image
-    
-    def get_yolo_result(self) -> dict:
-        with self.lock:
-            return self.yolo_result
-    
+        return self.latest().frame.image
+
+    def get_yolo_result(self) -> Any:
+        return self.latest().yolo_result
+
     def get_depth(self) -> Optional[NDArray[np.int16]]:
-        with self.lock:
-            return self.frame.depth
-        
-    def set(self, frame: Frame, yolo_result: dict):
-        with self.lock:
-            self.frame = frame
-            self.timestamp = time.time()
-            self.yolo_result = yolo_result
\ No newline at end of file
+        return self.latest().frame.depth
+
+    def set(self, frame: Frame, yolo_result: Any):
+        """A None result republishes the latest one for `frame`, see reuse()."""
+        with self.write_lock:
+            seq = self.seq + 1
+            result_ts = time.time()
+            if yolo_result is None:
+                latest = self.latest()
+                yolo_result = latest.yolo_result
+                detections = Detections(seq, result_ts, latest.detections.names, latest.detections.boxes,
+                                        latest.detections.confidences)
+            elif isinstance(yolo_result, dict):
+                detections = Detections.from_result(yolo_result, seq, result_ts)
+            else:
+                detections = Detections.from_batch(yolo_result, seq, result_ts)
+            entry = FrameEntry(seq, frame, yolo_result, detections, frame.timestamp, result_ts)
+            self.entries[seq % self.capacity] = entry
+            self.seq = seq
+            self.scene_memory.record(entry.detections)
+        with self.updated:
+            self.updated.notify_all()
+
+    def reuse(self, frame: Frame, reference_ts: float) -> bool:
+        """
+        Publishes the latest detections again, with a new timestamp, for a frame that did not change
+        since the one captured at `reference_ts`. Until that frame's result arrived the latest one may
+        describe the scene before the robot moved, nothing is published then.
+        """
+        if self.latest().capture_ts < reference_ts:
+            return False
+        self.set(frame, None)
+        return True
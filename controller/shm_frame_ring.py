@@ -0,0 +1,103 @@
+from multiprocessing import shared_memory, resource_tracker
+from numpy.typing import NDArray
+from typing import Optional, Tuple
+import numpy as np
+
+'''
+Ring of raw frames in shared memory, used instead of encoded images when the YOLO
+service runs on the same host. The controller creates the segment and writes
+frames; the service attaches by name and reads them as numpy views, without
+copying or decoding. Only the slot and sequence number travel over gRPC.
+
+The service imports this file directly, so it must not import the controller package.
+'''
+
+# slots, slot_size
+LAYOUT_DTYPE = np.dtype([('slots', np.int64), ('slot_size', np.int64)])
+# seq is -1 while the slot is being written
+SLOT_DTYPE = np.dtype([('seq', np.int64), ('height', np.int32), ('width', np.int32), ('channels', np.int32), ('pad', np.int32)])
+ALIGNMENT = 64
+
+def align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class SharedFrameRing:
+    def __init__(self, name: str, slots: int = 8, slot_size: int = 960 * 720 * 3, create: bool = False):
+        """Creates the segment with create=True (writer), otherwise attaches to it (reader)."""
+        self.owner = create
+        if create:
+            try:
+                # left over by a writer that did not exit cleanly
+                shared_memory.SharedMemory(name=name).unlink()
+            except FileNotFoundError:
+                pass
+            size = align(LAYOUT_DTYPE.itemsize) + align(slots * SLOT_DTYPE.itemsize) + slots * align(slot_size)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            layout = np.ndarray((), LAYOUT_DTYPE, buffer=self.shm.buf)
+            layout['slots'], layout['slot_size'] = slots, slot_size
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # before python 3.13 readers are tracked as well and would unlink the segment on exit
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            layout = np.ndarray((), LAYOUT_DTYPE, buffer=self.shm.buf)
+            slots, slot_size = int(layout['slots']), int(layout['slot_size'])
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.headers = np.ndarray((slots,), SLOT_DTYPE, buffer=self.shm.buf, offset=align(LAYOUT_DTYPE.itemsize))
+        self.data_offset = align(LAYOUT_DTYPE.itemsize) + align(slots * SLOT_DTYPE.itemsize)
+        if create:
+            self.headers['seq'] = -1
+        self.seq = 0
+
+    def fits(self, image: NDArray[np.uint8]) -> bool:
+        return image.dtype == np.uint8 and image.nbytes <= self.slot_size
+
+    def write(self, image: NDArray[np.uint8], reverse_channels: bool = False) -> Tuple[int, int]:
+        """
+        Copies an HxW or HxWxC uint8 image into the next slot and returns (slot, seq).
+        reverse_channels turns RGB into the BGR order numpy inputs of YOLO expect, in the same copy.
+        """
+        if not self.fits(image):
+            raise ValueError(f"Frame of {image.nbytes} bytes does not fit a {self.slot_size} byte slot")
+        self.seq += 1
+        slot = self.seq % self.slots
+        header = self.headers[slot]
+        header['seq'] = -1
+        channels = image.shape[2] if image.ndim == 3 else 1
+        view = self.view(slot, image.shape[0], image.shape[1], channels)
+        np.copyto(view.reshape(image.shape), image[..., ::-1] if reverse_channels and image.ndim == 3 else image)
+        header['height'], header['width'], header['channels'] = image.shape[0], image.shape[1], channels
+        header['seq'] = self.seq
+        return slot, self.seq
+
+    def view(self, slot: int, height: int, width: int, channels: int) -> NDArray[np.uint8]:
+        offset = self.data_offset + slot * align(self.slot_size)
+        return np.ndarray((height, width, channels), np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def read(self, slot: int, seq: int) -> Optional[NDArray[np.uint8]]:
+        """
+        A read-only view of the frame, None if the slot no longer holds `seq`. The view
+        is only valid until the writer wraps around, check is_current() after using it.
+        """
+        if not 0 <= slot < self.slots or not self.is_current(slot, seq):
+            return None
+        header = self.headers[slot]
+        image = self.view(slot, int(header['height']), int(header['width']), int(header['channels']))
+        image.flags.writeable = False
+        return image
+
+    def is_current(self, slot: int, seq: int) -> bool:
+        return int(self.headers[slot]['seq']) == seq
+
+    def close(self):
+        if self.owner:
+            # first, so the segment is removed even if a view still holds the mapping
+            self.shm.unlink()
+            self.owner = False
+        # views into the buffer must be released before the segment can be closed
+        self.headers = None
+        self.shm.close()
@@ -1,7 +1,7 @@
-import re
 from enum import Enum
-from typing import Optional, List, Union
+from typing import Optional, List, Union, FrozenSet
 from .abs.skill_item import SkillItem, SkillArg
+from .minispec_parser import Program, Call, Parameter, parse_program, walk, bind_parameters
 
 class SkillSetLevel(Enum):
     LOW = "low"
@@ -12,15 +12,51 @@ class SkillSet():
         self.skills = {}
         self.level = SkillSetLevel(level)
         self.lower_level_skillset = lower_level_skillset
+        # abbreviations are unique across a skillset and its lower-level skillset
+        if lower_level_skillset is not None:
+            self.abbr_dict = lower_level_skillset.abbr_dict
+        else:
+            self.abbr_dict = {}
+        # set of skill names -> whether they are all pure, see all_pure()
+        self.purity_cache = {}
+        # bumped whenever a skill is added or removed, caches of code validated against the set key on it
+        self.version = 0
     
     def get_skill(self, skill_name: str) -> Optional[SkillItem]:
         """Returns a SkillItem by its name or abbr."""
         skill = None
         if skill_name in self.skills:
             skill = self.skills[skill_name]
-        elif skill_name in SkillItem.abbr_dict:
-            skill = self.skills.get(SkillItem.abbr_dict[skill_name])
+        elif skill_name in self.abbr_dict:
+            skill = self.skills.get(self.abbr_dict[skill_name])
         return skill
+
+    def all_pure(self, skill_names: FrozenSet[str]) -> bool:
+        """True if every name or abbr is a pure low-level skill of this set, cached until the set changes."""
+        pure = self.purity_cache.get(skill_names)
+        if pure is None:
+            pure = all(isinstance(skill, LowLevelSkillItem) and skill.pure
+                       for skill in map(self.get_skill, skill_names))
+            self.purity_cache[skill_names] = pure
+        return pure
+
+    def generate_abbreviation(self, word: str) -> str:
+        split = word.split('_')
+        abbr = ''.join([part[0] for part in split])[0:2]
+
+        if abbr not in self.abbr_dict:
+            self.abbr_dict[abbr] = word
+            return abbr
+        
+        split = ''.join([part for part in split])[1:]
+
+        count = 0
+        while abbr in self.abbr_dict:
+            abbr = abbr[0] + split[count]
+            count += 1
+
+        self.abbr_dict[abbr] = word
+        return abbr
     
     def add_skill(self, skill_item: SkillItem):
         """Adds a SkillItem to the set."""
@@ -33,14 +69,22 @@ class SkillSet():
             else:
                 raise ValueError("Low-level skillset is not set.")
 
+        skill_item.abbr = self.generate_abbreviation(skill_item.skill_name)
         self.skills[skill_item.skill_name] = skill_item
+        self.purity_cache.clear()
+        self.version += 1
     
     def remove_skill(self, skill_name: str):
         """Removes a SkillItem from the set by its name."""
         if skill_name not in self.skills:
             raise ValueError(f"No skill found with the name '{skill_name}'.")
         # remove skill by value
+        abbr = self.skills[skill_name].abbr
+        if self.abbr_dict.get(abbr) == skill_name:
+            del self.abbr_dict[abbr]
         del self.skills[skill_name]
+        self.purity_cache.clear()
+        self.version += 1
     
     def __repr__(self) -> str:
         string = ""
@@ -50,13 +94,18 @@ class SkillSet():
 
 class LowLevelSkillItem(SkillItem):
     def __init__(self, skill_name: str, skill_callable: callable,
-                 skill_description: str = "", args: List[SkillArg] = []):
+                 skill_description: str = "", args: List[SkillArg] = [], pure: bool = False):
         self.skill_name = skill_name
-        self.abbr = self.generate_abbreviation(skill_name)
-        self.abbr_dict[self.abbr] = skill_name
+        # assigned by the SkillSet the skill is added to
+        self.abbr = None
         self.skill_callable = skill_callable
         self.skill_description = skill_description
         self.args = args
+        # pure skills only observe (e.g. perception), never act and return promptly, so
+        # the interpreter may run several of them concurrently on its shared workers.
+        # A skill that blocks, e.g. wait_until, is not pure: a worker running it cannot
+        # be stopped once a short-circuit discards its result
+        self.pure = pure
 
     def get_name(self) -> str:
         return self.skill_name
@@ -85,11 +134,13 @@ class HighLevelSkillItem(SkillItem):
     def __init__(self, skill_name: str, definition: str,
                  skill_description: str = ""):
         self.skill_name = skill_name
-        self.abbr = self.generate_abbreviation(skill_name)
-        self.abbr_dict[self.abbr] = skill_name
+        # assigned by the SkillSet the skill is added to
+        self.abbr = None
         self.definition = definition
         self.skill_description = skill_description
         self.low_level_skillset = None
+        # definition parsed once into a template with `$n` parameters
+        self.program: Optional[Program] = None
         self.args = []
 
     def load_from_dict(skill_dict: dict):
@@ -107,16 +158,17 @@ class HighLevelSkillItem(SkillItem):
     def set_skillset(self, low_level_skillset: SkillSet, high_level_skillset: SkillSet):
         self.low_level_skillset = low_level_skillset
         self.high_level_skillset = high_level_skillset
+        self.program = parse_program(self.definition)
         self.args = self.generate_argument_list()
 
     def generate_argument_list(self) -> List[SkillArg]:
-        # Extract all skill calls with their arguments from the code
-        skill_calls = re.findall(r'(\w+)\(([^)]*)\)', self.definition)
-
+        # Find every `$n` passed to a skill call in the parsed definition
         arg_types = {}
 
-        for skill_name, args in skill_calls:
-            args = [a.strip() for a in args.split(',')]
+        for call in walk(self.program):
+            if not isinstance(call, Call):
+                continue
+            skill_name, args = call.name, call.args
             if skill_name == "int":
                 function_args = [SkillArg("value", int)]
             elif skill_name == "float":
@@ -133,9 +185,9 @@ class HighLevelSkillItem(SkillItem):
 
                 function_args = skill.get_argument()
             for i, arg in enumerate(args):
-                if arg.startswith('$') and arg not in arg_types:
+                if isinstance(arg, Parameter) and arg.index not in arg_types:
                     # Match the positional argument with its type from the function definition
-                    arg_types[arg] = function_args[i]
+                    arg_types[arg.index] = function_args[i]
 
         # Convert the mapped arguments to a user-friendly list in order of $position
         arg_types = dict(sorted(arg_types.items()))
@@ -143,17 +195,13 @@ class HighLevelSkillItem(SkillItem):
 
         return arg_list
 
-    def execute(self, arg_list: List[Union[int, float, str]]):
-        """Executes the skill with the provided arguments."""
+    def execute(self, arg_list: List[Union[int, float, str]]) -> Program:
+        """Returns the definition with the provided arguments bound to $1, $2, ..."""
         if self.low_level_skillset is None:
             raise ValueError("Low-level skillset is not set.")
         if len(arg_list) != len(self.args):
             raise ValueError(f"Expected {len(self.args)} arguments, but got {len(arg_list)}.")
-        # replace all $1, $2, ... with segments
-        definition = self.definition
-        for i in range(0, len(arg_list)):
-            definition = definition.replace(f"${i + 1}", arg_list[i])
-        return definition
+        return bind_parameters(self.program, arg_list)
 
     def __repr__(self) -> str:
         return (f"abbr:{self.abbr},"
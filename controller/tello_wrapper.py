@@ -65,13 +65,15 @@ def cap_distance(distance):
 class TelloWrapper(RobotWrapper):
     def __init__(self):
         self.drone = Tello()
-        self.active_count = 0
+        # keep_active() is called once per captured frame, at a varying rate
+        self.last_keep_active = 0.0
         self.stream_on = False
 
     def keep_active(self):
-        if self.active_count % 20 == 0:
+        # the Tello lands when it receives no command for 15 seconds
+        if time.time() - self.last_keep_active >= 2.0:
             self.drone.send_control_command("command")
-        self.active_count += 1
+            self.last_keep_active = time.time()
 
     def connect(self):
         self.drone.connect()
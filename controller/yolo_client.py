@@ -1,4 +1,3 @@
-from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 from typing import Optional, Tuple
 from numpy.typing import NDArray
@@ -13,11 +12,15 @@ import threading
 
 from .utils import print_t
 from .shared_frame import SharedFrame, Frame
+from .frame_codec import FrameEncoder
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 
 VISION_SERVICE_IP = os.environ.get("VISION_SERVICE_IP", "localhost")
 ROUTER_SERVICE_PORT = os.environ.get("ROUTER_SERVICE_PORT", "50049")
+# webp, jpeg, png or raw
+YOLO_CODEC = os.environ.get("YOLO_CODEC", "webp")
+YOLO_CODEC_QUALITY = int(os.environ.get("YOLO_CODEC_QUALITY", "80"))
 
 '''
 Access the YOLO service through http.
@@ -30,15 +33,10 @@ class YoloClient():
         self.shared_frame = shared_frame
         self.frame_id = 0
         self.frame_id_lock = asyncio.Lock()
+        self.encoder = FrameEncoder(YOLO_CODEC, YOLO_CODEC_QUALITY)
 
     def is_local_service(self):
         return VISION_SERVICE_IP == 'localhost'
-
-    def image_to_bytes(image):
-        # compress and convert the image to bytes
-        imgByteArr = BytesIO()
-        image.save(imgByteArr, format='WEBP')
-        return imgByteArr.getvalue()
     
     def plot_results(frame, results):
         if results is None:
@@ -83,8 +81,7 @@ class YoloClient():
             print_t(f"[Y] Timeout error when connecting to {service_url}")
 
     def detect_local(self, frame: Frame, conf=0.2):
-        image = frame.image
-        image_bytes = YoloClient.image_to_bytes(image.resize(self.image_size))
+        image_bytes = self.encoder.encode(frame, self.image_size)
         self.frame_queue.put(frame)
 
         config = {
@@ -110,8 +107,11 @@ class YoloClient():
         if self.is_local_service():
             self.detect_local(frame, conf)
             return
-        image = frame.image
-        image_bytes = YoloClient.image_to_bytes(image.resize(self.image_size))
+        encoding = self.encoder.submit(frame, self.image_size)
+        if encoding is None:
+            # the encoder is behind, drop the frame rather than queue it
+            return
+        image_bytes = await asyncio.wrap_future(encoding)
 
         async with self.frame_id_lock:
             self.frame_queue.put((self.frame_id, frame))
@@ -1,13 +1,19 @@
-from io import BytesIO
 from PIL import Image
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
+from concurrent.futures import Future
+from collections import deque
 
-import json, sys, os
+import sys, os
 import queue
 import grpc
 import asyncio
+import threading
+import time
+import uuid
 
 from .yolo_client import SharedFrame, Frame
+from .shm_frame_ring import SharedFrameRing
+from .frame_codec import FrameEncoder, resize
 from .utils import print_t
 
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -20,12 +26,24 @@ import hyrch_serving_pb2_grpc
 
 VISION_SERVICE_IP = os.environ.get("VISION_SERVICE_IP", "localhost")
 YOLO_SERVICE_PORT = os.environ.get("YOLO_SERVICE_PORT", "50050").split(",")[0]
+# pass frames to a local service through shared memory instead of encoding them
+YOLO_SHARED_MEMORY = os.environ.get("YOLO_SHARED_MEMORY", "1") == "1"
+# frames sent on the DetectFrames stream but not answered yet, bounds how stale results can get
+YOLO_MAX_IN_FLIGHT = int(os.environ.get("YOLO_MAX_IN_FLIGHT", "2"))
+# encoding of frames that do not go through shared memory: webp, jpeg, png or raw
+YOLO_CODEC = os.environ.get("YOLO_CODEC", "webp")
+YOLO_CODEC_QUALITY = int(os.environ.get("YOLO_CODEC_QUALITY", "80"))
+# delay before reconnecting the DetectFrames stream, doubled up to the max while no result arrives
+STREAM_RETRY_DELAY = 1.0
+STREAM_RETRY_MAX_DELAY = 30.0
+# how long close() waits for the stream to end before removing the frame ring
+CLOSE_TIMEOUT = 2.0
 
 '''
 Access the YOLO service through gRPC.
 '''
 class YoloGRPCClient():
-    def __init__(self, shared_frame: SharedFrame=None):
+    def __init__(self, shared_frame: SharedFrame=None, max_in_flight: int=YOLO_MAX_IN_FLIGHT, max_pending: int=1):
         channel = grpc.insecure_channel(f'{VISION_SERVICE_IP}:{YOLO_SERVICE_PORT}')
         self.stub = hyrch_serving_pb2_grpc.YoloServiceStub(channel)
         self.is_async_inited = False
@@ -34,6 +52,34 @@ class YoloGRPCClient():
         self.shared_frame = shared_frame
         self.frame_id_lock = asyncio.Lock()
         self.frame_id = 0
+        # the service keeps this client's tracks under it, also across stream reconnects
+        self.session_id = uuid.uuid4().hex
+        self.encoder = FrameEncoder(YOLO_CODEC, YOLO_CODEC_QUALITY)
+        self.frame_ring = None
+        if YOLO_SHARED_MEMORY and self.is_local_service():
+            try:
+                # a slot must not be reused while its frame is still in flight. One ring per client,
+                # the service looks rings up by name and several controllers may share a process
+                self.frame_ring = SharedFrameRing(f'typefly_{os.getpid()}_{self.session_id[:8]}',
+                                                  slots=max(8, max_in_flight + 2), create=True)
+            except OSError as e:
+                print_t(f"[Y] Shared memory unavailable, sending encoded frames: {e}")
+
+        # DetectFrames stream, see submit()
+        self.max_in_flight = max_in_flight
+        # (frame, conf, encoding) waiting for the window, appending to a full deque drops the oldest
+        self.pending: deque[Tuple[Frame, float, Optional[Future]]] = deque(maxlen=max_pending)
+        # image_id -> (frame, time sent), in sending order
+        self.in_flight: Dict[int, Tuple[Frame, float]] = {}
+        # smoothed round-trip time of the stream, None until the first result
+        self.rtt: Optional[float] = None
+        self.stream_condition = threading.Condition()
+        self.stream_thread = None
+        self.stream_active = False
+        # a new stream id ends the request generator of the previous stream
+        self.stream_id = 0
+        self.retry_delay = STREAM_RETRY_DELAY
+        self.dropped_frames = 0
 
     def init_async_channel(self):
         channel_async = grpc.aio.insecure_channel(f'{VISION_SERVICE_IP}:{YOLO_SERVICE_PORT}')
@@ -43,26 +89,156 @@ class YoloGRPCClient():
     def is_local_service(self):
         return VISION_SERVICE_IP == 'localhost'
 
-    def image_to_bytes(image):
-        # compress and convert the image to bytes
-        imgByteArr = BytesIO()
-        image.save(imgByteArr, format='WEBP')
-        return imgByteArr.getvalue()
+    def encode_size(self) -> Optional[Tuple[int, int]]:
+        # do not resize for demo
+        return self.image_size if self.is_local_service() else None
 
     def retrieve(self) -> Optional[SharedFrame]:
         return self.shared_frame
     
+    def shared_request(self, frame_ring: SharedFrameRing, frame: Frame, conf, image_id: Optional[int]=None) -> hyrch_serving_pb2.DetectRequest:
+        # the ring is passed in, close_frame_ring() may drop it from another thread
+        image = frame.image_buffer
+        if not frame_ring.fits(image):
+            image = resize(image, self.image_size)
+        # the service feeds the frame to YOLO as a numpy array, which is BGR
+        slot, seq = frame_ring.write(image, reverse_channels=True)
+        shared_frame = hyrch_serving_pb2.SharedFrameRef(name=frame_ring.name, slot=slot, seq=seq)
+        return hyrch_serving_pb2.DetectRequest(image_id=image_id, shared_frame=shared_frame, conf=conf,
+                                              session_id=self.session_id)
+
+    def frame_request(self, frame: Frame, conf, image_id: int, encoding: Optional[Future]) -> hyrch_serving_pb2.DetectRequest:
+        frame_ring = self.frame_ring
+        if frame_ring is not None:
+            return self.shared_request(frame_ring, frame, conf, image_id)
+        # not encoded yet if the stream fell back from shared memory after submit()
+        image_bytes = encoding.result() if encoding is not None else self.encoder.encode(frame, self.encode_size())
+        return hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_bytes, conf=conf,
+                                              session_id=self.session_id)
+
+    def submit(self, frame: Frame, conf=0.2):
+        """
+        Queues the frame for the DetectFrames stream without blocking. At most max_in_flight
+        frames are waiting for a result, newer frames replace the oldest unsent one.
+        """
+        encoding = None
+        if self.frame_ring is None:
+            # encoded while earlier frames are in flight
+            encoding = self.encoder.submit(frame, self.encode_size())
+            if encoding is None:
+                self.dropped_frames += 1
+                return
+        with self.stream_condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped_frames += 1
+                dropped = self.pending[0][2]
+                if dropped is not None:
+                    dropped.cancel()
+            self.pending.append((frame, conf, encoding))
+            self.stream_condition.notify_all()
+            if self.stream_thread is None:
+                self.stream_active = True
+                self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+                self.stream_thread.start()
+
+    def stream_requests(self, stream_id: int):
+        while True:
+            with self.stream_condition:
+                self.stream_condition.wait_for(lambda: self.stream_id != stream_id or
+                                               (len(self.pending) > 0 and len(self.in_flight) < self.max_in_flight))
+                if self.stream_id != stream_id:
+                    return
+                frame, conf, encoding = self.pending.popleft()
+                image_id = self.frame_id
+                self.frame_id += 1
+                self.in_flight[image_id] = (frame, time.time())
+            yield self.frame_request(frame, conf, image_id, encoding)
+
+    def stream_loop(self):
+        while self.stream_active:
+            error = None
+            try:
+                for response in self.stub.DetectFrames(self.stream_requests(self.stream_id)):
+                    self.receive(response)
+            except grpc.RpcError as e:
+                error = e
+            with self.stream_condition:
+                self.stream_id += 1
+                # their results are lost with the stream
+                self.in_flight.clear()
+                self.stream_condition.notify_all()
+            if not self.stream_active:
+                break
+            if error is not None and error.code() == grpc.StatusCode.FAILED_PRECONDITION and self.frame_ring is not None:
+                print_t(f"[Y] Service cannot read shared memory, sending encoded frames: {error.details()}")
+                self.close_frame_ring()
+                continue
+            if error is not None:
+                print_t(f"[Y] Detection stream failed, reconnecting in {self.retry_delay:.0f}s: {error.code()}")
+            else:
+                print_t(f"[Y] Detection stream ended, reconnecting in {self.retry_delay:.0f}s")
+            # also after a clean end, e.g. a service that closes every stream right away
+            with self.stream_condition:
+                self.stream_condition.wait_for(lambda: not self.stream_active, timeout=self.retry_delay)
+                self.retry_delay = min(2 * self.retry_delay, STREAM_RETRY_MAX_DELAY)
+
+    def receive(self, response: hyrch_serving_pb2.DetectResponse):
+        with self.stream_condition:
+            frame, sent = self.in_flight.pop(response.image_id, (None, None))
+            if sent is not None:
+                rtt = time.time() - sent
+                self.rtt = rtt if self.rtt is None else 0.8 * self.rtt + 0.2 * rtt
+            # the stream works, the next reconnect is not delayed as long
+            self.retry_delay = STREAM_RETRY_DELAY
+            self.stream_condition.notify_all()
+        # no result if the service could not read the frame
+        if frame is not None and response.HasField('detections') and self.shared_frame is not None:
+            self.shared_frame.set(frame, response.detections)
+
+    def queue_depth(self) -> int:
+        """Frames submitted but not answered yet, more than max_in_flight means the service falls behind."""
+        with self.stream_condition:
+            return len(self.pending) + len(self.in_flight)
+
+    def close_frame_ring(self):
+        """Closes and unlinks the ring this client created, later frames are encoded."""
+        with self.stream_condition:
+            frame_ring, self.frame_ring = self.frame_ring, None
+        if frame_ring is not None:
+            frame_ring.close()
+
+    def close(self):
+        """Ends the stream and removes the frame ring, called when the controller shuts down."""
+        with self.stream_condition:
+            self.stream_active = False
+            self.stream_id += 1
+            self.stream_condition.notify_all()
+        if self.stream_thread is not None and self.stream_thread is not threading.current_thread():
+            # its requests are written to the ring
+            self.stream_thread.join(CLOSE_TIMEOUT)
+        self.close_frame_ring()
+
     def detect_local(self, frame: Frame, conf=0.2):
-        image = frame.image
-        image_bytes = YoloGRPCClient.image_to_bytes(image.resize(self.image_size))
         self.frame_queue.put(frame)
 
-        detect_request = hyrch_serving_pb2.DetectRequest(image_data=image_bytes, conf=conf)
-        response = self.stub.DetectStream(detect_request)
-        
-        json_results = json.loads(response.json_data)
+        response = None
+        frame_ring = self.frame_ring
+        if frame_ring is not None:
+            try:
+                response = self.stub.DetectStream(self.shared_request(frame_ring, frame, conf))
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.FAILED_PRECONDITION:
+                    raise
+                # e.g. the service runs in a container without a shared /dev/shm
+                print_t(f"[Y] Service cannot read shared memory, sending encoded frames: {e.details()}")
+                self.close_frame_ring()
+        if response is None:
+            image_bytes = self.encoder.encode(frame, self.image_size)
+            detect_request = hyrch_serving_pb2.DetectRequest(image_data=image_bytes, conf=conf, session_id=self.session_id)
+            response = self.stub.DetectStream(detect_request)
+
         if self.shared_frame is not None:
-            self.shared_frame.set(self.frame_queue.get(), json_results)
+            self.shared_frame.set(self.frame_queue.get(), response.detections)
 
     async def detect(self, frame: Frame, conf=0.1):
         if not self.is_async_inited:
@@ -72,9 +248,11 @@ class YoloGRPCClient():
             self.detect_local(frame, conf)
             return
 
-        image = frame.image
-        # do not resize for demo
-        image_bytes = YoloGRPCClient.image_to_bytes(image)
+        encoding = self.encoder.submit(frame, self.encode_size())
+        if encoding is None:
+            # the encoder is behind, drop the frame rather than queue it
+            return
+        image_bytes = await asyncio.wrap_future(encoding)
         async with self.frame_id_lock:
             image_id = self.frame_id
             self.frame_queue.put((self.frame_id, frame))
@@ -83,14 +261,13 @@ class YoloGRPCClient():
         detect_request = hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_bytes, conf=conf)
         response = await self.stub_async.Detect(detect_request)
     
-        json_results = json.loads(response.json_data)
         if self.frame_queue.empty():
             return
         # discard old images
-        while self.frame_queue.queue[0][0] < json_results['image_id']:
+        while self.frame_queue.queue[0][0] < response.image_id:
             self.frame_queue.get()
         # discard old results
-        if self.frame_queue.queue[0][0] > json_results['image_id']:
+        if self.frame_queue.queue[0][0] > response.image_id:
             return
         if self.shared_frame is not None:
-            self.shared_frame.set(self.frame_queue.get()[1], json_results)
\ No newline at end of file
+            self.shared_frame.set(self.frame_queue.get()[1], response.detections)
\ No newline at end of file
@@ -54,9 +54,11 @@ async def process_yolo():
         stub = hyrch_serving_pb2_grpc.YoloServiceStub(channel)
         image_contents = image_data.read()
         if stream_mode:
-            response = await stub.DetectStream(hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_contents, conf=conf))
+            response = await stub.DetectStream(hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_contents,
+                                                                               conf=conf, session_id=user_name, json=True))
         else:
-            response = await stub.Detect(hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_contents, conf=conf))
+            response = await stub.Detect(hyrch_serving_pb2.DetectRequest(image_id=image_id, image_data=image_contents, conf=conf,
+                                                                         json=True))
     finally:
         if not stream_mode:
             await grpcServiceManager.release_service_channel("yolo", channel)
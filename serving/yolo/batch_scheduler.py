@@ -0,0 +1,91 @@
+import queue, threading, time
+from concurrent.futures import Future
+from typing import Any, Callable, List, NamedTuple
+
+# controller/ is on sys.path, see yolo_service.py
+from metrics import Histogram, LatencyMetrics
+
+'''
+Collects requests from concurrent RPC threads into batches for one forward pass.
+A batch runs as soon as it is full or its oldest request has waited max_delay,
+so a lone request pays at most max_delay for the chance to share a pass.
+'''
+
+class PendingRequest(NamedTuple):
+    item: Any
+    future: Future
+    enqueued: float
+
+class BatchScheduler:
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_delay: float = 0.01, log_interval: float = 60.0):
+        if max_batch_size < 1:
+            raise ValueError(f"Invalid batch size: {max_batch_size}")
+        # takes a list of items, returns one result per item in the same order
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue: queue.Queue[PendingRequest] = queue.Queue()
+        # queue wait and batch run time in seconds, and batch size / max_batch_size
+        self.metrics = LatencyMetrics()
+        self.fill = Histogram()
+        self.log_interval = log_interval
+        self.last_log = time.time()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        self.queue.put(PendingRequest(item, future, time.perf_counter()))
+        return future
+
+    def run(self, item: Any) -> Any:
+        """Blocks until the batch containing the item has run."""
+        return self.submit(item).result()
+
+    def next_batch(self) -> List[PendingRequest]:
+        batch = [self.queue.get()]
+        deadline = batch[0].enqueued + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # past the deadline, still take what is already queued
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            start = time.perf_counter()
+            for request in batch:
+                self.metrics.observe('batch', 'queue_wait', start - request.enqueued)
+            self.fill.observe(len(batch) / self.max_batch_size)
+            try:
+                results = self.run_batch([request.item for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                self.metrics.observe('batch', 'run', time.perf_counter() - start)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+            if self.log_interval > 0 and time.time() - self.last_log >= self.log_interval:
+                print(self.report())
+                self.last_log = time.time()
+
+    def summary(self) -> dict:
+        summary = self.metrics.summary().get('batch', {})
+        summary['fill'] = self.fill.summary()
+        return summary
+
+    def report(self) -> str:
+        summary = self.summary()
+        def ms(value):
+            return 'n/a' if value is None else f'{value * 1e3:.1f}ms'
+        wait, run, fill = summary.get('queue_wait', {}), summary.get('run', {}), summary['fill']
+        return (f"Batches: {fill['count']}, fill p50 {fill['p50'] or 0:.2f}, "
+                f"queue wait p50 {ms(wait.get('p50'))} p99 {ms(wait.get('p99'))}, "
+                f"run p50 {ms(run.get('p50'))} p99 {ms(run.get('p99'))}")
@@ -0,0 +1,91 @@
+import threading, time
+from typing import Any, Callable, Dict, List
+
+'''
+The shared frame rings the service is attached to, by segment name. A mapping
+keeps the segment's memory alive even after its writer unlinked it, so rings
+are closed when their DetectFrames stream ends, when a read fails and after
+idle_timeout without requests. A ring still in use by a request is closed
+once that request releases it.
+'''
+
+class AttachedRing:
+    def __init__(self, ring: Any):
+        self.ring = ring
+        # requests between acquire() and release()
+        self.users = 0
+        self.last_used = time.time()
+        # no longer handed out, closed once the last user releases it
+        self.dropped = False
+
+class FrameRings:
+    def __init__(self, attach: Callable[[str], Any], idle_timeout: float = 60.0):
+        self.attach = attach
+        self.idle_timeout = idle_timeout
+        self.rings: Dict[str, AttachedRing] = {}
+        # closed with views into them still alive, closing is retried on eviction
+        self.closing: List[AttachedRing] = []
+        self.lock = threading.Lock()
+        # rings of clients that stop sending are closed without waiting for another request
+        self.thread = threading.Thread(target=self.evict_loop, daemon=True)
+        self.thread.start()
+
+    def __len__(self) -> int:
+        return len(self.rings)
+
+    def acquire(self, name: str) -> AttachedRing:
+        """The attached ring, attaching on first use, raises what attach() raises. Pair with release()."""
+        with self.lock:
+            attached = self.rings.get(name)
+            if attached is None:
+                attached = AttachedRing(self.attach(name))
+                self.rings[name] = attached
+                print(f"Frame ring {name} attached, {len(self.rings)} active")
+            attached.users += 1
+            attached.last_used = time.time()
+            return attached
+
+    def release(self, attached: AttachedRing):
+        with self.lock:
+            attached.users -= 1
+            attached.last_used = time.time()
+            if attached.dropped and attached.users == 0:
+                self.close(attached)
+
+    def drop(self, name: str, reason: str):
+        """Stops handing out the ring, the next request attaches again, e.g. to a recreated segment."""
+        with self.lock:
+            attached = self.rings.pop(name, None)
+            if attached is None:
+                return
+            attached.dropped = True
+            print(f"Frame ring {name} dropped, {reason}, {len(self.rings)} active")
+            if attached.users == 0:
+                self.close(attached)
+
+    def close(self, attached: AttachedRing):
+        """Caller holds self.lock."""
+        try:
+            attached.ring.close()
+        except BufferError:
+            # a numpy view of a frame outlived its request, e.g. in the batch the scheduler last ran
+            if attached not in self.closing:
+                self.closing.append(attached)
+            return
+        if attached in self.closing:
+            self.closing.remove(attached)
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            for attached in list(self.closing):
+                self.close(attached)
+            idle = [name for name, attached in self.rings.items()
+                    if attached.users == 0 and now - attached.last_used > self.idle_timeout]
+        for name in idle:
+            self.drop(name, f"idle for {self.idle_timeout:.0f}s")
+
+    def evict_loop(self):
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            self.evict_idle()
@@ -0,0 +1,272 @@
+import os, sys, ast, glob, time, argparse
+from abc import ABC, abstractmethod
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple
+import numpy as np
+import torch
+from PIL import Image
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.engine.results import Results
+from ultralytics.utils import ops, yaml_load
+
+'''
+Inference backends of the YOLO service. A backend takes a list of images (PIL, or
+BGR arrays from the shared frame ring) and returns one ultralytics Results per
+image, so tracking and result formatting work the same on all of them.
+
+The ONNX Runtime and OpenVINO backends are for hosts without a GPU. They run an
+export of the weights, made once next to the .pt file, with the preprocessing
+and NMS of ultralytics. Each runs on a fixed number of intra-op threads, so the
+worker processes of one host do not compete for every core.
+
+The launcher prepares a model once with prepare() and forks the workers, which
+build their backend from it with load_backend(): torch workers share the weights
+in shared memory, OpenVINO workers map the same IR file.
+
+    python inference_backends.py export --int8            # export ahead of time, e.g. in the image
+    python inference_backends.py bench --backends torch,onnxruntime,openvino --batch-sizes 1,4
+'''
+
+# square input of the exported models, ultralytics' default
+IMAGE_SIZE = 640
+# ultralytics' predict defaults
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+
+def to_bgr(image: Image.Image | np.ndarray) -> np.ndarray:
+    if isinstance(image, Image.Image):
+        return np.ascontiguousarray(np.asarray(image.convert('RGB'))[..., ::-1])
+    return image
+
+def export_onnx(weights: str, int8: bool = False) -> str:
+    """Path of the ONNX export of the weights, exported on first use."""
+    path = os.path.splitext(weights)[0] + '.onnx'
+    if not os.path.exists(path):
+        print(f"Exporting {weights} to ONNX")
+        # dynamic axes, so batches of any size run on it
+        path = YOLO(weights).export(format='onnx', imgsz=IMAGE_SIZE, dynamic=True, simplify=True)
+    if not int8:
+        return path
+    quantized = os.path.splitext(weights)[0] + '-int8.onnx'
+    if not os.path.exists(quantized):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print(f"Quantizing {path} to INT8")
+        # weights only, activations are quantized at run time, so no calibration data is needed
+        quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+    return quantized
+
+def export_openvino(weights: str, int8: bool = False) -> str:
+    """
+    Directory of the OpenVINO IR of the weights, exported on first use. INT8 is
+    quantized by ultralytics with NNCF, calibrating on its default dataset.
+    """
+    directory = os.path.splitext(weights)[0] + ('_int8' if int8 else '') + '_openvino_model'
+    if not os.path.isdir(directory):
+        print(f"Exporting {weights} to {'INT8 ' if int8 else ''}OpenVINO")
+        directory = YOLO(weights).export(format='openvino', imgsz=IMAGE_SIZE, dynamic=True, int8=int8)
+    return directory
+
+def isolated(function, *args):
+    """
+    Runs the function in a fresh process. Exporting starts the thread pools of the
+    runtimes, which must not happen in a process that forks workers afterwards.
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+def onnx_names(weights: str) -> Dict[int, str]:
+    """Class names ultralytics stores in the metadata of its ONNX export."""
+    import onnx
+    model = onnx.load(export_onnx(weights), load_external_data=False)
+    metadata = {prop.key: prop.value for prop in model.metadata_props}
+    return ast.literal_eval(metadata['names'])
+
+class PreparedModel(NamedTuple):
+    """What a worker builds its backend from, see prepare()."""
+    # the YOLO model for torch, the path of the exported model otherwise
+    model: Any
+    names: Dict[int, str]
+
+class TorchBackend:
+    @staticmethod
+    def prepare(weights: str, int8: bool = False) -> PreparedModel:
+        if int8:
+            print("Warning: INT8 is only supported by the onnxruntime and openvino backends")
+        # single-threaded, forked workers cannot use a thread pool started here
+        torch.set_num_threads(1)
+        model = YOLO(weights)
+        # ultralytics fuses on the first inference, which would give every worker its own copy
+        model.fuse()
+        model.model.requires_grad_(False)
+        # forked workers map the same pages instead of copying them on access
+        model.model.share_memory()
+        return PreparedModel(model, model.names)
+
+    def __init__(self, prepared: PreparedModel, threads: int):
+        torch.set_num_threads(threads)
+        self.model = prepared.model
+        self.names = prepared.names
+        # after the fork, CUDA is first initialized in the worker
+        if torch.cuda.is_available():
+            # a copy per worker, CUDA memory cannot be inherited through fork
+            self.model.to(torch.device('cuda:0'))
+        print(f"GPU memory usage: {torch.cuda.memory_allocated()}")
+
+    def __call__(self, images: List[Any], conf: float) -> List[Results]:
+        return self.model(images, verbose=False, conf=conf)
+
+class ExportedBackend(ABC):
+    """Runs an exported model, subclasses implement prepare(), load() and infer()."""
+    def __init__(self, prepared: PreparedModel, threads: int):
+        self.names = prepared.names
+        # no stride-aligned padding, every image of a batch must have the same shape
+        self.letterbox = LetterBox((IMAGE_SIZE, IMAGE_SIZE), auto=False)
+        self.load(prepared.model, threads)
+
+    @abstractmethod
+    def load(self, path: str, threads: int):
+        pass
+
+    @abstractmethod
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        pass
+
+    def preprocess(self, images: List[np.ndarray]) -> np.ndarray:
+        batch = np.stack([self.letterbox(image=image) for image in images])
+        # BGR HWC uint8 -> RGB CHW float in [0, 1]
+        batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+        batch /= 255
+        return batch
+
+    def __call__(self, images: List[Any], conf: float) -> List[Results]:
+        images = [to_bgr(image) for image in images]
+        batch = self.preprocess(images)
+        predictions = torch.from_numpy(self.infer(batch))
+        detections = ops.non_max_suppression(predictions, conf_thres=conf, iou_thres=IOU_THRESHOLD,
+                                             max_det=MAX_DETECTIONS)
+        results = []
+        for det, image in zip(detections, images):
+            det[:, :4] = ops.scale_boxes(batch.shape[2:], det[:, :4], image.shape)
+            results.append(Results(image, path='', names=self.names, boxes=det))
+        return results
+
+class OnnxRuntimeBackend(ExportedBackend):
+    @staticmethod
+    def prepare(weights: str, int8: bool = False) -> PreparedModel:
+        path = isolated(export_onnx, weights, int8)
+        return PreparedModel(path, onnx_names(weights))
+
+    def load(self, path: str, threads: int):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        # a single model runs one node at a time, a second pool would only add threads
+        options.inter_op_num_threads = 1
+        # each worker holds its own copy of the weights, ONNX Runtime cannot share them across processes
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenVINOBackend(ExportedBackend):
+    @staticmethod
+    def prepare(weights: str, int8: bool = False) -> PreparedModel:
+        directory = isolated(export_openvino, weights, int8)
+        names = yaml_load(os.path.join(directory, 'metadata.yaml'))['names']
+        return PreparedModel(glob.glob(os.path.join(directory, '*.xml'))[0], names)
+
+    def load(self, path: str, threads: int):
+        import openvino as ov
+        core = ov.Core()
+        # the weights file is memory-mapped, workers on the same IR share its pages
+        model = core.read_model(path)
+        self.model = core.compile_model(model, 'CPU', {'INFERENCE_NUM_THREADS': threads, 'PERFORMANCE_HINT': 'LATENCY'})
+
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        return self.model(batch)[0]
+
+# name -> backend class, register more here
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnxruntime': OnnxRuntimeBackend,
+    'openvino': OpenVINOBackend,
+}
+
+def prepare(name: str, weights: str, int8: bool = False) -> PreparedModel:
+    """Exports and loads what the workers of a backend share, once, before they are forked."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}, available: {', '.join(BACKENDS)}")
+    return BACKENDS[name].prepare(weights, int8)
+
+def load_backend(name: str, prepared: PreparedModel, threads: int):
+    return BACKENDS[name](prepared, threads)
+
+def warm_up(backend, batch_size: int = 1, repeat: int = 2) -> float:
+    """
+    Runs blank frames through the backend, the first inferences allocate buffers and
+    pick kernels. Returns the time of the last run in seconds.
+    """
+    frame = np.zeros((352, 640, 3), dtype=np.uint8)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        backend([frame] * batch_size, conf=0.25)
+    return time.perf_counter() - start
+
+def bench(backend, frames: List[np.ndarray], batch_size: int, repeat: int) -> Dict[str, float]:
+    """Latency percentiles of a batch in ms and throughput in frames per second, on the same frames."""
+    latencies = []
+    detections = 0
+    start = time.perf_counter()
+    for i in range(repeat):
+        batch = [frames[(i * batch_size + j) % len(frames)] for j in range(batch_size)]
+        batch_start = time.perf_counter()
+        results = backend(batch, conf=0.25)
+        latencies.append(time.perf_counter() - batch_start)
+        detections += sum(len(result.boxes) for result in results)
+    elapsed = time.perf_counter() - start
+    return {
+        'p50': np.percentile(latencies, 50) * 1e3,
+        'p90': np.percentile(latencies, 90) * 1e3,
+        'fps': repeat * batch_size / elapsed,
+        # a backend that disagrees with the others here lost accuracy
+        'detections': detections / (repeat * batch_size),
+    }
+
+def load_frames(paths: List[str]) -> List[np.ndarray]:
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, '*'))) if os.path.isdir(path) else [path]
+    # as the client sends them
+    return [to_bgr(Image.open(file).convert('RGB').resize((640, 352))) for file in files]
+
+if __name__ == '__main__':
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="Export the YOLO model or compare the inference backends")
+    parser.add_argument('command', choices=['export', 'bench'])
+    parser.add_argument('--weights', default=os.path.join(root, 'serving', 'yolo', 'models', 'yolov8x.pt'))
+    parser.add_argument('--int8', action='store_true')
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--images', nargs='+', default=[os.path.join(root, 'test', 'images')])
+    parser.add_argument('--batch-sizes', default='1,4')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        print(export_onnx(args.weights, args.int8))
+        print(export_openvino(args.weights, args.int8))
+        sys.exit(0)
+
+    frames = load_frames(args.images)
+    print(f"{len(frames)} frames, {args.threads} threads{', INT8' if args.int8 else ''}")
+    print(f"{'backend':12s} {'batch':>5s} {'warm-up ms':>10s} {'p50 ms':>8s} {'p90 ms':>8s} {'fps':>7s} {'objects':>7s}")
+    for name in args.backends.split(','):
+        backend = load_backend(name, prepare(name, args.weights, args.int8), args.threads)
+        for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            warm_up_ms = warm_up(backend, batch_size) * 1e3
+            result = bench(backend, frames, batch_size, args.repeat)
+            print(f"{name:12s} {batch_size:5d} {warm_up_ms:10.1f} {result['p50']:8.1f} {result['p90']:8.1f} "
+                  f"{result['fps']:7.1f} {result['detections']:7.1f}")
@@ -0,0 +1,57 @@
+import threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+'''
+Tracker state per client session, so streaming clients never share track ids
+and share the detector weights instead of each loading a tracking model.
+Sessions idle for longer than idle_timeout are dropped.
+'''
+
+class Session:
+    def __init__(self, tracker: Any):
+        self.tracker = tracker
+        # frames of one session are tracked in order, one at a time
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+class TrackingSessions:
+    def __init__(self, create_tracker: Callable[[], Any], idle_timeout: float = 60.0, max_sessions: int = 64):
+        self.create_tracker = create_tracker
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    @contextmanager
+    def acquire(self, session_id: str) -> Iterator[Any]:
+        """The session's tracker, created on first use, held exclusively for the with-block."""
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    oldest = min(self.sessions, key=lambda id: self.sessions[id].last_used)
+                    del self.sessions[oldest]
+                    print(f"Tracking session {oldest} evicted, too many sessions")
+                session = Session(self.create_tracker())
+                self.sessions[session_id] = session
+                print(f"Tracking session {session_id} started, {len(self.sessions)} active")
+            session.last_used = time.time()
+        with session.lock:
+            yield session.tracker
+
+    def close(self, session_id: str):
+        with self.lock:
+            if self.sessions.pop(session_id, None) is not None:
+                print(f"Tracking session {session_id} closed, {len(self.sessions)} active")
+
+    def evict_idle(self):
+        """Caller holds self.lock."""
+        now = time.time()
+        for session_id in [id for id, session in self.sessions.items() if now - session.last_used > self.idle_timeout]:
+            del self.sessions[session_id]
+            print(f"Tracking session {session_id} evicted after {self.idle_timeout:.0f}s idle")
@@ -0,0 +1,63 @@
+import os
+from typing import List, NamedTuple
+
+'''
+Splits the host's cores between the YOLO worker processes. Every worker gets
+whole physical cores, with their hyperthread siblings, as its CPU affinity and
+one intra-op thread per physical core, so workers neither migrate across each
+other's cores nor oversubscribe them.
+'''
+
+class WorkerSlot(NamedTuple):
+    cpus: List[int]
+    threads: int
+
+def core_groups() -> List[List[int]]:
+    """The logical CPUs this process may run on, grouped by physical core."""
+    groups = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            with open(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list') as f:
+                core = f.read().strip()
+        except OSError:
+            # no topology, e.g. in some containers: count every CPU as a core
+            core = str(cpu)
+        groups.setdefault(core, []).append(cpu)
+    return list(groups.values())
+
+def gpu_count() -> int:
+    """
+    GPUs the workers will see, without initializing CUDA: a process that did
+    cannot fork workers that use it. Counts the devices of the NVIDIA driver,
+    or of CUDA_VISIBLE_DEVICES if it is set.
+    """
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None:
+        devices = []
+        for device in visible.split(','):
+            # CUDA ignores the devices from the first invalid one on, e.g. -1
+            if device.strip() in ('', '-1'):
+                break
+            devices.append(device)
+        return len(devices)
+    try:
+        return len(os.listdir('/proc/driver/nvidia/gpus'))
+    except OSError:
+        return 0
+
+def default_workers(cores_per_worker: int) -> int:
+    return max(1, len(core_groups()) // cores_per_worker)
+
+def plan(workers: int, cores_per_worker: int) -> List[WorkerSlot]:
+    """
+    Consecutive cores for each worker. With more workers than fit, the cores are
+    handed out round-robin again and workers share them.
+    """
+    groups = core_groups()
+    cores_per_worker = max(1, min(cores_per_worker, len(groups)))
+    slots = []
+    for worker in range(workers):
+        start = worker * cores_per_worker
+        cores = [groups[(start + i) % len(groups)] for i in range(cores_per_worker)]
+        slots.append(WorkerSlot(sorted(cpu for core in cores for cpu in core), cores_per_worker))
+    return slots
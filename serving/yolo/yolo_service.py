@@ -1,78 +1,172 @@
-import sys, os, gc
+import sys, os
 from concurrent import futures
 from PIL import Image
 from io import BytesIO
+import itertools
 import json
 import grpc
 import torch
-from ultralytics import YOLO
+import numpy as np
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
 import multiprocessing
 
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 ROOT_PATH = os.environ.get("ROOT_PATH", PARENT_DIR)
 SERVICE_PORT = os.environ.get("YOLO_SERVICE_PORT", "50050, 50051").split(",")
+# each DetectFrames stream holds a server thread for its whole lifetime
+MAX_STREAMS = int(os.environ.get("YOLO_MAX_STREAMS", "4"))
+# concurrent Detect requests share one forward pass, waiting at most the delay for others
+MAX_BATCH_SIZE = int(os.environ.get("YOLO_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_DELAY = float(os.environ.get("YOLO_MAX_BATCH_DELAY_MS", "10")) / 1000
+# tracking sessions without a request for this long are dropped
+SESSION_TIMEOUT = float(os.environ.get("YOLO_SESSION_TIMEOUT", "60"))
+# shared frame rings without a request for this long are closed
+FRAME_RING_TIMEOUT = float(os.environ.get("YOLO_FRAME_RING_TIMEOUT", "60"))
+# torch, onnxruntime or openvino, see inference_backends.py
+BACKEND = os.environ.get("YOLO_BACKEND", "torch")
+YOLO_INT8 = os.environ.get("YOLO_INT8", "0") == "1"
+# physical cores, and intra-op threads, of each worker process
+CORES_PER_WORKER = int(os.environ.get("YOLO_THREADS", "4"))
+# worker processes, by default as many as the cores allow, see worker_layout.py
+WORKERS = os.environ.get("YOLO_WORKERS")
 
 MODEL_PATH = os.path.join(ROOT_PATH, "./serving/yolo/models/")
 MODEL_TYPE = "yolov8x.pt"
+TRACKER_TYPE = "bytetrack.yaml"
 
 sys.path.append(ROOT_PATH)
 sys.path.append(os.path.join(ROOT_PATH, "proto/generated"))
+sys.path.append(os.path.join(ROOT_PATH, "controller"))
 import hyrch_serving_pb2
 import hyrch_serving_pb2_grpc
+from shm_frame_ring import SharedFrameRing
+from batch_scheduler import BatchScheduler
+from tracking_sessions import TrackingSessions
+from frame_rings import FrameRings
+from inference_backends import load_backend, prepare, warm_up
+import worker_layout
 
-def load_model():
-    model = YOLO(MODEL_PATH + MODEL_TYPE)
-    if torch.cuda.is_available():
-        device = torch.device('cuda:0')
-    else:
-        device = torch.device('cpu')
-    model.to(device)
-    print(f"GPU memory usage: {torch.cuda.memory_allocated()}")
-    return model
-
-def release_model(model):
-    del model
-    gc.collect()
-    torch.cuda.empty_cache()
+def track(tracker, yolo_result, conf):
+    """What model.track() does after the forward pass, with a session's own tracker."""
+    # the tracker only sees the detections the request asked for
+    yolo_result = yolo_result[yolo_result.boxes.conf >= conf]
+    det = yolo_result.boxes.cpu().numpy()
+    if len(det) == 0:
+        return yolo_result
+    tracks = tracker.update(det, yolo_result.orig_img)
+    if len(tracks) == 0:
+        return yolo_result
+    # tracks: xyxy, track_id, conf, class_id, index of the detection
+    yolo_result = yolo_result[tracks[:, -1].astype(int)]
+    yolo_result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return yolo_result
 
 """
     gRPC service class.
 """
 class YoloService(hyrch_serving_pb2_grpc.YoloServiceServicer):
-    def __init__(self, port):
-        self.stream_mode = False
-        self.model = load_model()
+    def __init__(self, port, model):
+        # one set of weights for every client, only the batcher thread runs it
+        self.model = model
+        # the first requests would otherwise pay for allocations and kernel selection
+        warm_up_time = warm_up(self.model)
+        print(f"{BACKEND} backend warmed up, inference takes {warm_up_time * 1e3:.0f}ms")
         self.port = port
-
-    def reload_model(self):
-        if self.model is not None:
-            release_model(self.model)
-        self.model = load_model()
+        # frame rings of local clients, by segment name
+        self.frame_rings = FrameRings(SharedFrameRing, FRAME_RING_TIMEOUT)
+        self.batcher = BatchScheduler(self.detect_batch, MAX_BATCH_SIZE, MAX_BATCH_DELAY)
+        tracker_config = IterableSimpleNamespace(**yaml_load(check_yaml(TRACKER_TYPE)))
+        self.sessions = TrackingSessions(lambda: BYTETracker(args=tracker_config, frame_rate=30), SESSION_TIMEOUT)
+        # names the sessions of DetectFrames streams that do not bring their own
+        self.stream_ids = itertools.count()
 
     @staticmethod
     def bytes_to_image(image_bytes):
         return Image.open(BytesIO(image_bytes))
-    
+
+    def detect(self, request, context, session_id=None):
+        """The response, None if the client overwrote the shared frame before it was read."""
+        image_id = request.image_id if request.HasField('image_id') else None
+        if not request.HasField('shared_frame'):
+            image = YoloService.bytes_to_image(request.image_data)
+            return self.process_image(image, image_id, request.conf, session_id, request.json)
+        ref = request.shared_frame
+        try:
+            attached = self.frame_rings.acquire(ref.name)
+        except (FileNotFoundError, PermissionError) as e:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"Cannot attach to shared memory {ref.name}: {e}")
+        try:
+            try:
+                # a BGR numpy view of the frame
+                image = attached.ring.read(ref.slot, ref.seq)
+            except Exception as e:
+                self.frame_rings.drop(ref.name, f"read failed: {e}")
+                raise
+            if image is None:
+                # also what a writer that recreated the segment under the same name looks like
+                self.frame_rings.drop(ref.name, f"frame {ref.seq} not found")
+                return None
+            response = self.process_image(image, image_id, request.conf, session_id, request.json)
+            # the ring cannot be closed while a view into it is alive
+            del image
+            if not attached.ring.is_current(ref.slot, ref.seq):
+                # the client wrapped around the ring during inference, the result may mix two frames
+                print(f"Warning: frame {ref.seq} was overwritten during inference")
+            return response
+        finally:
+            self.frame_rings.release(attached)
+
+    @staticmethod
+    def result_rows(yolo_result, conf=0.0):
+        """
+        Rows of xyxy, track_id if tracking, conf, class_id at or above `conf`, as a float32
+        array, with their indices in the result and the boxes normalized to the image size.
+        """
+        data = yolo_result.boxes.data.cpu().numpy().astype(np.float32, copy=False)
+        # the batch ran at the lowest threshold of its requests
+        keep = np.flatnonzero(data[:, -2] >= conf)
+        data = data[keep]
+        h, w = yolo_result.orig_shape
+        boxes = data[:, :4] / np.array([w, h, w, h], dtype=np.float32)
+        return data, keep, boxes
+
     @staticmethod
-    def format_result(yolo_result):
+    def to_detections(yolo_result, conf=0.0):
+        data, _, boxes = YoloService.result_rows(yolo_result, conf)
+        # only the classes present, the model may know thousands
+        class_ids, index = np.unique(data[:, -1].astype(np.int64), return_inverse=True)
+        detections = hyrch_serving_pb2.DetectionBatch(
+            class_names=[yolo_result.names[class_id] for class_id in class_ids.tolist()],
+            boxes=boxes.ravel().tolist(),
+            confidences=data[:, -2].tolist(),
+            class_ids=index.ravel().tolist())
+        if yolo_result.boxes.is_track:
+            detections.track_ids.extend(data[:, -3].astype(np.int64).tolist())
+        return detections
+
+    @staticmethod
+    def format_result(yolo_result, conf=0.0):
         if yolo_result.probs is not None:
             print('Warning: Classify task do not support `tojson` yet.')
             return
         formatted_result = []
-        data = yolo_result.boxes.data.cpu().tolist()
+        data, keep, boxes = YoloService.result_rows(yolo_result, conf)
         h, w = yolo_result.orig_shape
-        for i, row in enumerate(data):  # xyxy, track_id if tracking, conf, class_id
-            box = {'x1': round(row[0] / w, 2), 'y1': round(row[1] / h, 2), 'x2': round(row[2] / w, 2), 'y2': round(row[3] / h, 2)}
-            conf = row[-2]
-            class_id = int(row[-1])
-
-            name = yolo_result.names[class_id]
-            if yolo_result.boxes.is_track:
-                # result['track_id'] = int(row[-3])  # track ID
-                name = f'{name}_{int(row[-3])}'
-            result = {'name': name, 'confidence': round(conf, 2), 'box': box}
-            
+        # rounded in float64, float32 values print with spurious digits
+        boxes = np.round(boxes.astype(np.float64), 2).tolist()
+        confidences = np.round(data[:, -2].astype(np.float64), 2).tolist()
+        class_ids = data[:, -1].astype(np.int64).tolist()
+        track_ids = data[:, -3].astype(np.int64).tolist() if yolo_result.boxes.is_track else None
+        for row, i in enumerate(keep.tolist()):
+            x1, y1, x2, y2 = boxes[row]
+            name = yolo_result.names[class_ids[row]]
+            if track_ids is not None:
+                name = f'{name}_{track_ids[row]}'
+            result = {'name': name, 'confidence': confidences[row], 'box': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}}
+
             if yolo_result.masks:
                 x, y = yolo_result.masks.xy[i][:, 0], yolo_result.masks.xy[i][:, 1]  # numpy array
                 result['segments'] = {'x': (x / w).tolist(), 'y': (y / h).tolist()}
@@ -82,53 +176,104 @@ class YoloService(hyrch_serving_pb2_grpc.YoloServiceServicer):
             formatted_result.append(result)
         return formatted_result
     
-    def process_image(self, image, id=None, conf=0.3):
-        if self.stream_mode:
-            yolo_result = self.model.track(image, verbose=False, conf=conf, tracker="bytetrack.yaml")[0]
-        else:
-            yolo_result = self.model(image, verbose=False, conf=conf)[0]
-        result = {
-            "image_id": id,
-            "result": YoloService.format_result(yolo_result),
-        }
-        return json.dumps(result)
+    def process_image(self, image, id=None, conf=0.3, session_id=None, as_json=False):
+        """Detects in a shared batch, then tracks with the session's tracker if one is given."""
+        yolo_result = self.batcher.run((image, conf))
+        if session_id is not None:
+            with self.sessions.acquire(session_id) as tracker:
+                yolo_result = track(tracker, yolo_result, conf)
+        if as_json:
+            result = {
+                "image_id": id,
+                "result": YoloService.format_result(yolo_result, conf),
+            }
+            return hyrch_serving_pb2.DetectResponse(image_id=id, json_data=json.dumps(result))
+        return hyrch_serving_pb2.DetectResponse(image_id=id, detections=YoloService.to_detections(yolo_result, conf))
+
+    def detect_batch(self, requests):
+        """Runs a batch of (image, conf) from the BatchScheduler in one forward pass."""
+        # the batch runs at the lowest threshold, format_result and track() apply each request's own
+        return self.model([image for image, _ in requests], conf=min(conf for _, conf in requests))
 
     def DetectStream(self, request, context):
         print(f"Received DetectStream request from {context.peer()} on port {self.port}, image_id: {request.image_id}")
-        if not self.stream_mode:
-            self.stream_mode = True
-            self.reload_model()
-        
-        image = YoloService.bytes_to_image(request.image_data)
-        return hyrch_serving_pb2.DetectResponse(json_data=self.process_image(image, request.image_id, request.conf))
+        response = self.detect(request, context, request.session_id or context.peer())
+        if response is None:
+            context.abort(grpc.StatusCode.ABORTED, f"Frame {request.shared_frame.seq} was overwritten before it was read")
+        return response
     
     def Detect(self, request, context):
         print(f"Received Detect request from {context.peer()} on port {self.port}, image_id: {request.image_id}")
-        if self.stream_mode:
-            self.stream_mode = False
-            self.reload_model()
-
-        image = YoloService.bytes_to_image(request.image_data)
-        return hyrch_serving_pb2.DetectResponse(json_data=self.process_image(image, request.image_id, request.conf))
-
-def serve(port):
-    print(f"Starting YoloService at port {port}")
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-    hyrch_serving_pb2_grpc.add_YoloServiceServicer_to_server(YoloService(port), server)
-    server.add_insecure_port(f'[::]:{port}')
+        response = self.detect(request, context)
+        if response is None:
+            context.abort(grpc.StatusCode.ABORTED, f"Frame {request.shared_frame.seq} was overwritten before it was read")
+        return response
+
+    def DetectFrames(self, request_iterator, context):
+        print(f"Started DetectFrames stream from {context.peer()} on port {self.port}")
+        # a client that names its session keeps its tracks across reconnects
+        stream_session = f"{context.peer()}#{next(self.stream_ids)}"
+        # frame rings the stream sent frames from
+        stream_rings = set()
+        try:
+            for request in request_iterator:
+                if request.HasField('shared_frame'):
+                    stream_rings.add(request.shared_frame.name)
+                response = self.detect(request, context, request.session_id or stream_session)
+                if response is None:
+                    # answer anyway without detections, the client counts the frame as done
+                    json_data = json.dumps({"image_id": request.image_id, "result": None}) if request.json else ""
+                    response = hyrch_serving_pb2.DetectResponse(image_id=request.image_id, json_data=json_data)
+                yield response
+        finally:
+            self.sessions.close(stream_session)
+            for name in stream_rings:
+                self.frame_rings.drop(name, "stream closed")
+        print(f"DetectFrames stream from {context.peer()} closed")
+
+def worker_ports(worker, worker_count):
+    """
+    Every port is served: with fewer workers than ports a worker binds several, with
+    more, workers bind the same ports and the kernel spreads connections over them.
+    """
+    ports = [SERVICE_PORT[i % len(SERVICE_PORT)].strip()
+             for i in range(worker, max(worker_count, len(SERVICE_PORT)), worker_count)]
+    return list(dict.fromkeys(ports))
+
+def serve(ports, prepared, slot):
+    port = ", ".join(ports)
+    os.sched_setaffinity(0, slot.cpus)
+    print(f"Starting YoloService at port {port} on CPUs {slot.cpus}")
+    model = load_backend(BACKEND, prepared, slot.threads)
+    # enough threads for a full batch of Detect requests next to the streams
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_STREAMS + MAX_BATCH_SIZE),
+                         options=[("grpc.so_reuseport", 1)])
+    hyrch_serving_pb2_grpc.add_YoloServiceServicer_to_server(YoloService(port, model), server)
+    for worker_port in ports:
+        server.add_insecure_port(f'[::]:{worker_port}')
     server.start()
+    print(f"YoloService ready at port {port}")
     server.wait_for_termination()
 
 if __name__ == '__main__':
-    # Create a pool of processes
-    process_count = len(SERVICE_PORT)
+    if WORKERS is not None:
+        worker_count = int(WORKERS)
+    elif BACKEND == "torch" and worker_layout.gpu_count() > 0:
+        # GPU-bound, and each worker holds its own copy on the GPU. Each worker picks its
+        # device after the fork, CUDA must not be initialized here
+        worker_count = len(SERVICE_PORT)
+    else:
+        worker_count = worker_layout.default_workers(CORES_PER_WORKER)
+    # loaded once here, the forked workers inherit the weights instead of loading their own
+    prepared = prepare(BACKEND, MODEL_PATH + MODEL_TYPE, YOLO_INT8)
+    context = multiprocessing.get_context('fork')
     processes = []
 
-    for i in range(process_count):
-        process = multiprocessing.Process(target=serve, args=(SERVICE_PORT[i],))
+    for i, slot in enumerate(worker_layout.plan(worker_count, CORES_PER_WORKER)):
+        process = context.Process(target=serve, args=(worker_ports(i, worker_count), prepared, slot))
         process.start()
         processes.append(process)
 
     # Wait for all processes to complete
     for process in processes:
-        process.join()
\ No newline at end of file
+        process.join()
@@ -0,0 +1,60 @@
+import sys, os, io, time, argparse
+from typing import List, Tuple
+from PIL import Image
+import numpy as np
+
+'''
+Encode time versus payload size of the frame codecs, to pick one for a link.
+Transfer time is the payload at the given bandwidth, a frame costs roughly
+encode + transfer + decode on the service.
+
+    python codec-benchmark.py                       # test/images/kitchen.webp at 640x352
+    python codec-benchmark.py --size 960x720 --mbps 5
+'''
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+from controller.frame_codec import CODECS, FrameEncoder
+from controller.shared_frame import Frame
+
+def bench_codec(frame: Frame, codec: str, quality: int, repeat: int) -> Tuple[float, int, float]:
+    """Best encode time in ms, payload bytes and best decode time in ms."""
+    encoder = FrameEncoder(codec, quality, workers=1)
+    encoded, decoded = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encoder.encode(frame)
+        encoded.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        # as the service reads it
+        Image.open(io.BytesIO(data)).load()
+        decoded.append(time.perf_counter() - start)
+    return min(encoded) * 1e3, len(data), min(decoded) * 1e3
+
+def parse_size(size: str) -> Tuple[int, int]:
+    width, height = size.lower().split('x')
+    return int(width), int(height)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frame codec benchmark")
+    parser.add_argument('--image', default=os.path.join(PARENT_DIR, 'test', 'images', 'kitchen.webp'))
+    parser.add_argument('--size', default='640x352', help="frame size the client sends, WIDTHxHEIGHT")
+    parser.add_argument('--codecs', default=','.join(CODECS))
+    parser.add_argument('--qualities', default='50,80,95')
+    parser.add_argument('--mbps', type=float, default=20.0, help="link bandwidth for the transfer time column")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert('RGB').resize(parse_size(args.size))
+    frame = Frame(np.asarray(image))
+    qualities: List[int] = [int(quality) for quality in args.qualities.split(',')]
+
+    print(f"{args.image} at {args.size}, {args.mbps:g} Mbit/s link")
+    print(f"{'codec':8s} {'quality':>7s} {'encode ms':>10s} {'KB':>9s} {'transfer ms':>12s} {'decode ms':>10s} {'total ms':>9s}")
+    for codec in args.codecs.split(','):
+        # png and raw are lossless, quality only changes png's compression level
+        for quality in (qualities if codec != 'raw' else [0]):
+            encode_ms, size, decode_ms = bench_codec(frame, codec, quality, args.repeat)
+            transfer_ms = size * 8 / (args.mbps * 1e6) * 1e3
+            print(f"{codec:8s} {quality:7d} {encode_ms:10.2f} {size / 1024:9.1f} {transfer_ms:12.2f} {decode_ms:10.2f} "
+                  f"{encode_ms + transfer_ms + decode_ms:9.2f}")
@@ -0,0 +1,230 @@
+import sys, os, io, json, time, re, argparse, platform, statistics
+from contextlib import redirect_stdout
+from typing import Iterator, List
+
+'''
+Headless MiniSpec interpreter benchmarks, no robot, GPU or network needed. Skills
+are mocks (no-op or fixed-latency) registered under the real low-level skill names,
+high-level skills come from the real high_level_skills.json.
+
+    python interpreter-benchmark.py            # compare against the baseline
+    python interpreter-benchmark.py --save     # record a new baseline
+'''
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+from controller.skillset import SkillSet, LowLevelSkillItem, HighLevelSkillItem, SkillArg
+from controller import minispec_interpreter
+from controller.minispec_interpreter import MiniSpecInterpreter, MiniSpecProgram, ExecutionContext, \
+    call_skill, compile_statement, compile_condition, compile_program, compile_high_level_skill
+from controller.minispec_parser import parse_program
+
+BASELINE_PATH = os.path.join(PARENT_DIR, 'test', 'interpreter-benchmark-baseline.json')
+
+minispec_interpreter.print_debug = lambda *args: None
+
+# (name, args, pure), mirrors the low-level skills registered by LLMController
+MOCK_SKILLS = [
+    ('move_forward', [SkillArg('distance', int)], False),
+    ('move_backward', [SkillArg('distance', int)], False),
+    ('move_left', [SkillArg('distance', int)], False),
+    ('move_right', [SkillArg('distance', int)], False),
+    ('move_up', [SkillArg('distance', int)], False),
+    ('move_down', [SkillArg('distance', int)], False),
+    ('turn_cw', [SkillArg('degrees', int)], False),
+    ('turn_ccw', [SkillArg('degrees', int)], False),
+    ('delay', [SkillArg('seconds', float)], False),
+    ('is_visible', [SkillArg('object_name', str)], True),
+    ('object_x', [SkillArg('object_name', str)], True),
+    ('object_y', [SkillArg('object_name', str)], True),
+    ('object_width', [SkillArg('object_name', str)], True),
+    ('object_height', [SkillArg('object_name', str)], True),
+    ('object_dis', [SkillArg('object_name', str)], True),
+    ('wait_until', [SkillArg('condition', str), SkillArg('timeout', float)], False),
+    ('probe', [SkillArg('question', str)], False),
+    ('log', [SkillArg('text', str)], False),
+    ('take_picture', [], False),
+    ('re_plan', [], False),
+    ('goto', [SkillArg('object_name[*x-value]', str)], False),
+    ('time', [], False),
+]
+MOCK_RETURNS = {
+    'is_visible': False,
+    'object_x': 0.5,
+    'object_y': 0.5,
+    'object_width': 0.2,
+    'object_height': 0.2,
+    'object_dis': 100.0,
+    'wait_until': True,
+    'probe': False,
+    'time': 0.0,
+}
+
+def mock_skill(name: str, latency: float):
+    value = MOCK_RETURNS.get(name)
+    replan = name == 're_plan'
+    def skill(*args):
+        if latency > 0:
+            time.sleep(latency)
+        return value, replan
+    return skill
+
+def build_context(latency: float = 0.0) -> ExecutionContext:
+    low_level_skillset = SkillSet(level="low")
+    for name, args, pure in MOCK_SKILLS:
+        low_level_skillset.add_skill(LowLevelSkillItem(name, mock_skill(name, latency), args=args, pure=pure))
+    high_level_skillset = SkillSet(level="high", lower_level_skillset=low_level_skillset)
+    with open(os.path.join(PARENT_DIR, 'controller/assets/tello/high_level_skills.json'), 'r') as f:
+        for skill in json.load(f):
+            high_level_skillset.add_skill(HighLevelSkillItem.load_from_dict(skill))
+    return ExecutionContext(low_level_skillset, high_level_skillset)
+
+def load_corpus() -> List[str]:
+    """Plans from the prompt examples, i.e. what the LLM is asked to produce."""
+    with open(os.path.join(PARENT_DIR, 'controller/assets/tello/plan_examples.txt'), 'r') as f:
+        return re.findall(r'^Response: (.+)$', f.read(), re.MULTILINE)
+
+def clear_caches():
+    for cache in (compile_statement, compile_condition, compile_program, compile_high_level_skill):
+        cache.cache_clear()
+
+def run_plan(ctx: ExecutionContext, code) -> MiniSpecInterpreter:
+    interpreter = MiniSpecInterpreter(ctx, None)
+    with redirect_stdout(io.StringIO()):
+        interpreter.execute(code)
+        interpreter.ret_queue.get()
+        interpreter.execution_thread.join()
+    return interpreter
+
+def chunks(code: str, size: int = 1, delay: float = 0.0) -> Iterator[str]:
+    """Fake LLM stream, a generator so the interpreter treats it as streamed."""
+    for i in range(0, len(code), size):
+        if delay > 0:
+            time.sleep(delay)
+        yield code[i:i + size]
+
+# microbenchmarks report the best of the repeats, like timeit, which is the least noisy
+
+def bench_parse(ctx: ExecutionContext, corpus: List[str], repeat: int) -> dict:
+    total = sum(len(code) for code in corpus)
+    streamed, batch = [], []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        for code in corpus:
+            MiniSpecProgram(ctx).parse([code])
+        streamed.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for code in corpus:
+            parse_program(code)
+        batch.append(time.perf_counter() - start)
+    return {
+        'parse_streamed_chars_per_s': (total / min(streamed), 'chars/s', True),
+        'parse_batch_chars_per_s': (total / min(batch), 'chars/s', True),
+    }
+
+def bench_dispatch(ctx: ExecutionContext, statements: int, repeat: int) -> dict:
+    code = "l('x');" * statements
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_plan(ctx, chunks(code, 64))
+        samples.append((time.perf_counter() - start) / statements)
+    return {'statement_dispatch_us': (min(samples) * 1e6, 'us', False)}
+
+def bench_loop(ctx: ExecutionContext, iterations: int, repeat: int) -> dict:
+    code = f"{iterations}{{l('x')}}"
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_plan(ctx, chunks(code, 64))
+        samples.append((time.perf_counter() - start) / iterations)
+    return {'loop_iteration_us': (min(samples) * 1e6, 'us', False)}
+
+def bench_high_level(ctx: ExecutionContext, repeat: int) -> dict:
+    # scan: 8 iterations of is_visible + turn_cw with the mocks
+    cold, warm = [], []
+    for _ in range(repeat):
+        compile_high_level_skill.cache_clear()
+        start = time.perf_counter()
+        call_skill(ctx, 'scan', ['apple'])
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        call_skill(ctx, 'scan', ['apple'])
+        warm.append(time.perf_counter() - start)
+    return {
+        'high_level_cold_us': (min(cold) * 1e6, 'us', False),
+        'high_level_warm_us': (min(warm) * 1e6, 'us', False),
+    }
+
+def bench_time_to_first_action(ctx: ExecutionContext, plan: str, chunk_size: int, chunk_delay: float, repeat: int) -> dict:
+    streamed, batch = [], []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.time()
+        interpreter = run_plan(ctx, chunks(plan, chunk_size, chunk_delay))
+        streamed.append(interpreter.timestamp_first_action - start)
+
+        clear_caches()
+        start = time.time()
+        # batch: wait for the whole response before executing
+        code = list(chunks(plan, chunk_size, chunk_delay))
+        interpreter = run_plan(ctx, code)
+        batch.append(interpreter.timestamp_first_action - start)
+    return {
+        'ttfa_streamed_ms': (statistics.median(streamed) * 1e3, 'ms', False),
+        'ttfa_batch_ms': (statistics.median(batch) * 1e3, 'ms', False),
+    }
+
+def run_benchmarks(repeat: int, latency: float) -> dict:
+    noop = build_context()
+    fixed = build_context(latency)
+    corpus = load_corpus()
+    results = {}
+    results.update(bench_parse(noop, corpus, repeat * 20))
+    results.update(bench_dispatch(noop, 200, repeat))
+    results.update(bench_loop(noop, 500, repeat))
+    results.update(bench_high_level(noop, repeat))
+    # example 1 of the prompt, streamed at roughly LLM speed
+    results.update(bench_time_to_first_action(fixed, "tc(45);?s('bottle')==True{g('bottle');_2=oh('bottle');l(_2);tp};tu(45);", 4, 0.02, max(1, repeat // 2)))
+    return {name: {'value': value, 'unit': unit, 'higher_is_better': higher} for name, (value, unit, higher) in results.items()}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        change = (new - old) / old if old != 0 else 0.0
+        worse = -change if result['higher_is_better'] else change
+        marker = ''
+        if worse > tolerance:
+            marker = '  << REGRESSION'
+            regressions.append(name)
+        print(f"{name:32s} {new:14.2f} {result['unit']:8s} baseline {old:14.2f} ({change:+.1%}){marker}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MiniSpec interpreter benchmarks")
+    parser.add_argument('--save', action='store_true', help="record the results as the new baseline")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.005, help="latency of the fixed-latency mock skills in seconds")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="relative slowdown reported as a regression")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.latency)
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump({'platform': platform.platform(), 'python': platform.python_version(), 'results': results}, f, indent=2)
+        for name, result in results.items():
+            print(f"{name:32s} {result['value']:14.2f} {result['unit']}")
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    print(f"Baseline recorded on {baseline['platform']}, python {baseline['python']}")
+    regressions = compare(results, baseline['results'], args.tolerance)
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,99 @@
+import sys, os
+from typing import Iterator, List
+
+'''
+Headless checks of how the MiniSpec interpreter handles plans that go wrong,
+no robot, GPU or network needed. Skills are mocks that record their calls.
+
+    python interpreter-stream-test.py
+'''
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+from controller.skillset import SkillSet, LowLevelSkillItem, SkillArg
+from controller import minispec_interpreter
+from controller.minispec_interpreter import MiniSpecInterpreter, ExecutionContext
+
+minispec_interpreter.print_debug = lambda *args: None
+
+# a stuck executor must fail the check, not hang it
+JOIN_TIMEOUT = 5.0
+
+calls: List[tuple] = []
+
+def recorder(name: str, replan: bool = False):
+    def record(*args):
+        calls.append((name,) + args)
+        return None, replan
+    return record
+
+def create_context() -> ExecutionContext:
+    low_level_skillset = SkillSet(level="low")
+    low_level_skillset.add_skill(LowLevelSkillItem('log', recorder('log'), args=[SkillArg('text', str)]))
+    low_level_skillset.add_skill(LowLevelSkillItem('turn_cw', recorder('turn_cw'), args=[SkillArg('degrees', int)]))
+    low_level_skillset.add_skill(LowLevelSkillItem('re_plan', recorder('re_plan', replan=True)))
+    return ExecutionContext(low_level_skillset, SkillSet(level="high", lower_level_skillset=low_level_skillset))
+
+def failing_stream(code: str) -> Iterator[str]:
+    """Streams the code, then fails like a dropped LLM connection."""
+    yield code
+    raise ConnectionError('stream dropped')
+
+def check_stream_failure(context: ExecutionContext, code: str, stream=failing_stream):
+    calls.clear()
+    interpreter = MiniSpecInterpreter(context, None)
+    error = None
+    try:
+        interpreter.execute(stream(code))
+    except Exception as e:
+        error = e
+    assert error is not None, f'{code!r}: the stream error was swallowed'
+    interpreter.execution_thread.join(JOIN_TIMEOUT)
+    assert not interpreter.execution_thread.is_alive(), f'{code!r}: the executor thread did not finish'
+    ret_val = interpreter.ret_queue.get_nowait()
+    print(f'{code!r} -> {ret_val}, calls: {calls}')
+    return ret_val
+
+def run(context: ExecutionContext, code) -> tuple:
+    calls.clear()
+    interpreter = MiniSpecInterpreter(context, None)
+    interpreter.execute(code)
+    interpreter.execution_thread.join(JOIN_TIMEOUT)
+    assert not interpreter.execution_thread.is_alive(), f'{code!r}: the executor thread did not finish'
+    ret_val = interpreter.ret_queue.get_nowait()
+    print(f'{code!r} -> {ret_val}, calls: {calls}')
+    return ret_val, list(calls)
+
+if __name__ == "__main__":
+    context = create_context()
+    # stream fails inside a block, and inside a nested block
+    check_stream_failure(context, "3{l('a');")
+    check_stream_failure(context, "l('a');?True{tc(10);2{l('b');")
+    # an invalid block header raises while parsing, inside an open block
+    check_stream_failure(context, "3{l('a');x{", stream=lambda code: iter([code]))
+
+    # a complete plan is compiled from its optimized tree, literals keep their exact value
+    for text in ['line1\nline2', 'C:\\drone\\log', '{a;b}']:
+        ret_val, log = run(context, [f"l('{text}');"])
+        assert not ret_val.replan and log == [('log', text)], f'{text!r} became {log}'
+    # both paths replan on a plan that fails validation
+    ret_val, log = run(context, ["l('a');foo(1);l('b');"])
+    assert ret_val.replan and 'Invalid plan' in ret_val.value and log == [], log
+    ret_val, log = run(context, iter(["l('a');foo(1);l('b');"]))
+    assert ret_val.replan and 'Invalid plan' in ret_val.value and log == [('log', 'a')], log
+    ret_val, log = run(context, iter(["l('a');?_1>1{tc(10);}"]))
+    assert ret_val.replan and 'Invalid plan' in ret_val.value and log == [('log', 'a')], log
+    # a replan inside a block with a constant condition still ends the plan
+    ret_val, log = run(context, ["?True{rp;l('a')};l('b');"])
+    assert ret_val.replan and log == [('re_plan',)], log
+    # variables assigned earlier in the stream, also inside a block, are valid
+    ret_val, log = run(context, iter(["_1=3;2{_2=_1+1;};tc(_2);"]))
+    assert not ret_val.replan and log == [('turn_cw', 4)], log
+    # both paths time the statements nested in blocks
+    counts = []
+    for code in (["_1=0;?_1!=1{2{l('b');tc(5)};l('c')};3{l('d')};"], iter(["_1=0;?_1!=1{2{l('b');tc(5)};l('c')};3{l('d')};"])):
+        context = create_context()
+        run(context, code)
+        counts.append({kind: context.metrics.get('statement', kind)['count'] for kind in ('expr', 'if', 'loop')})
+    assert counts[0] == counts[1] == {'expr': 9, 'if': 1, 'loop': 2}, counts
+    print('OK')
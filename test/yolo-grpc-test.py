@@ -21,7 +21,8 @@ YOLO_SERVICE_PORT = os.environ.get("YOLO_SERVICE_PORT", "50050").split(",")[0]
 channel = grpc.insecure_channel(f'{VISION_SERVICE_IP}:{YOLO_SERVICE_PORT}')
 stub = hyrch_serving_pb2_grpc.YoloServiceStub(channel)
 
-detect_request = hyrch_serving_pb2.DetectRequest(image_data=image_to_bytes(Image.open("./images/kitchen.webp")), conf=0.3)
+# detections come as packed arrays unless json is requested
+detect_request = hyrch_serving_pb2.DetectRequest(image_data=image_to_bytes(Image.open("./images/kitchen.webp")), conf=0.3, json=True)
 response = stub.DetectStream(detect_request)
 
 class_request = hyrch_serving_pb2.SetClassRequest(class_names=['shoes'])